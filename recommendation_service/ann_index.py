@@ -0,0 +1,159 @@
+import argparse
+import os
+import threading
+import numpy as np
+from scoring import interest_weights, ratings_weights, stack_candidates, normalize_rows, to_vector
+from indexes import candidate_projection, candidate_batch_size, live_videos
+
+# Optional approximate retrieval stage for get_top_3: an IVF (inverted file) index over
+# one fused vector per video. Probing a few coarse clusters returns a few hundred
+# candidates, which the exact weighted-cosine scorer then reranks.
+
+ann_index_path = os.getenv("ANN_INDEX_PATH", "ann_index.npz")
+ann_candidates = int(os.getenv("ANN_CANDIDATES", "300"))
+ann_probe = int(os.getenv("ANN_PROBE", "8"))
+
+def fuse(matrices, weights):
+    # Weighted sum of the normalized feature vectors, renormalized per video
+    num_videos = len(next(iter(matrices.values()))[1])
+    fused = None
+    for feature, weight in weights.items():
+        matrix, mask = matrices[feature]
+        if matrix.shape[1] == 0:
+            continue
+        if fused is None:
+            fused = np.zeros((num_videos, matrix.shape[1]), dtype=np.float32)
+        fused += weight * matrix * mask[:, None]
+    if fused is None:
+        return np.zeros((num_videos, 0), dtype=np.float32)
+    return normalize_rows(fused)
+
+def fuse_query(queries, weights):
+    fused = None
+    for feature, weight in weights.items():
+        vector = to_vector(queries.get(feature))
+        if vector is None:
+            continue
+        vector = normalize_rows(vector)
+        fused = weight * vector if fused is None else fused + weight * vector
+    return None if fused is None else normalize_rows(fused)
+
+def spherical_kmeans(vectors, num_lists, iterations=10, seed=0, sample_size=50000):
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), sample_size), replace=False)]
+    centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(num_lists):
+            members = sample[assignment == i]
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+        centroids = normalize_rows(centroids)
+    return centroids
+
+class IVFIndex:
+    def __init__(self, centroids, assignment, ids, vectors, durations):
+        self.centroids = centroids
+        self.ids = np.asarray(ids)
+        self.vectors = vectors
+        self.durations = durations
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(centroids))]
+        self.row_of = {video_id: row for row, video_id in enumerate(ids)}
+
+    @classmethod
+    def build(cls, ids, vectors, durations, num_lists=None, iterations=10, seed=0):
+        num_lists = num_lists or max(1, min(len(vectors), int(4 * np.sqrt(len(vectors)))))
+        centroids = spherical_kmeans(vectors, num_lists, iterations, seed)
+        assignment = np.concatenate([np.argmax(vectors[s:s + 65536] @ centroids.T, axis=1) for s in range(0, len(vectors), 65536)])
+        return cls(centroids, assignment, ids, vectors, durations)
+
+    def search(self, query, num_candidates=ann_candidates, num_probe=ann_probe, duration_range=None, exclude=()):
+        if query is None or len(self.ids) == 0:
+            return []
+        num_probe = min(num_probe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ query), num_probe - 1)[:num_probe]
+        rows = np.concatenate([self.lists[i] for i in probed])
+        if duration_range is not None:
+            durations = self.durations[rows]
+            rows = rows[(durations >= duration_range[0]) & (durations <= duration_range[1])]
+        if exclude:
+            excluded = [self.row_of[v] for v in exclude if v in self.row_of]
+            rows = rows[~np.isin(rows, excluded)]
+        if len(rows) > num_candidates:
+            scores = self.vectors[rows] @ query
+            rows = rows[np.argpartition(-scores, num_candidates - 1)[:num_candidates]]
+        return self.ids[rows].tolist()
+
+    def save(self, path):
+        assignment = np.empty(len(self.ids), dtype=np.int32)
+        for i, rows in enumerate(self.lists):
+            assignment[rows] = i
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, centroids=self.centroids, assignment=assignment, ids=self.ids, vectors=self.vectors, durations=self.durations)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        return cls(data['centroids'], data['assignment'], data['ids'].tolist(), data['vectors'], data['durations'])
+
+def build_from_collection(video_collection, num_lists=None):
+    ids = []
+    fused = []
+    durations = []
+    projection = dict(candidate_projection, duration_in_seconds=1)
+    chunk = []
+    for video in video_collection.find(live_videos, projection).batch_size(candidate_batch_size):
+        chunk.append(video)
+        if len(chunk) == candidate_batch_size:
+            fuse_chunk(chunk, ids, fused, durations)
+            chunk = []
+    if chunk:
+        fuse_chunk(chunk, ids, fused, durations)
+    if not ids:
+        raise ValueError('No videos to index')
+    return IVFIndex.build(ids, np.concatenate(fused), np.asarray(durations, dtype=np.int32), num_lists)
+
+def fuse_chunk(chunk, ids, fused, durations):
+    chunk_ids, matrices = stack_candidates(chunk)
+    ids.extend(chunk_ids)
+    fused.append(fuse(matrices, interest_weights))
+    durations.extend(video.get('duration_in_seconds', 0) for video in chunk)
+
+loaded_index = None
+loaded_index_lock = threading.Lock()
+
+def get_ann_index():
+    # Loaded once per process on first use; None when no index has been built
+    global loaded_index
+    if loaded_index is None:
+        with loaded_index_lock:
+            if loaded_index is None and os.path.exists(ann_index_path):
+                loaded_index = IVFIndex.load(ann_index_path)
+    return loaded_index
+
+def ann_candidate_ids(index, user, interest_embedding, duration_range, exclude=(), num_candidates=ann_candidates, num_probe=ann_probe):
+    candidate_ids = set()
+    if interest_embedding is not None:
+        query = fuse_query({feature: interest_embedding for feature in interest_weights}, interest_weights)
+        candidate_ids.update(index.search(query, num_candidates, num_probe, duration_range, exclude))
+    if user.get("total_videos", 0) > 0 and user.get("average_video"):
+        query = fuse_query(user["average_video"], ratings_weights)
+        candidate_ids.update(index.search(query, num_candidates, num_probe, duration_range, exclude))
+    return list(candidate_ids)
+
+def main():
+    from providers import get_collection
+    parser = argparse.ArgumentParser(description='Build the ANN retrieval index from the videos collection')
+    parser.add_argument('--path', default=ann_index_path)
+    parser.add_argument('--lists', type=int, default=None, help='number of IVF lists (default 4*sqrt(N))')
+    args = parser.parse_args()
+
+    index = build_from_collection(get_collection('videos'), args.lists)
+    index.save(args.path)
+    print(f"Indexed {len(index.ids)} videos into {len(index.centroids)} lists at {args.path}")
+
+if __name__ == '__main__':
+    main()
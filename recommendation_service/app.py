@@ -1,17 +1,48 @@
-from flask import Flask, request, jsonify
-from pymongo import MongoClient
-from model import get_top_3, update_average_video_embedding
+from flask import Flask, Response, g, request, jsonify
+from model import get_top_3, get_top_3_batch, default_retrieval
+from providers import get_collection, get_database, warm_up
+from rating_events import record_rating, get_rating_aggregator
+from recommendation_cache import get_recommendation_cache
+from indexes import user_profile_projection, video_info_projection
+from rating_queue import add_to_queue as queue_video, get_queue_page, remove_from_queue as unqueue_video
+from metrics import current_endpoint, request_seconds, timed_stage, start_profile, finish_profile, render_metrics
 from bson.objectid import ObjectId
-from datetime import datetime
 from bson import json_util
+import logging
+import os
+import time
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client['sparetime_database']
-video_collection = db['videos']
-users_collection = db['users']
-queue_colection = db['rating_queue']
+if os.getenv("WARM_UP_MODEL") == "1":
+    warm_up()
+
+# Start folding ratings left pending by an earlier process instead of waiting for the next rating
+if os.getenv("START_RATING_AGGREGATOR", "1") == "1":
+    get_rating_aggregator()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.endpoint_token = current_endpoint.set(request.endpoint or 'unknown')
+    g.profiler = start_profile()
+
+@app.after_request
+def observe_request(response):
+    endpoint = request.endpoint or 'unknown'
+    request_seconds.labels(endpoint, response.status_code).observe(time.perf_counter() - g.request_start)
+    if g.profiler is not None:
+        finish_profile(g.profiler, endpoint)
+    current_endpoint.reset(g.endpoint_token)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
 
 @app.route('/api/top3', methods=['GET'])
 def get_top_3_videos():
@@ -19,14 +50,36 @@ def get_top_3_videos():
     duration = int(request.headers.get('duration'))
     if not user_id:
         return jsonify({"error": "User ID not provided"}), 400
-    user = users_collection.find_one({ "_id": ObjectId(user_id) })
+    with timed_stage('mongo_fetch'):
+        user = get_collection('users').find_one({ "_id": ObjectId(user_id) }, user_profile_projection)
     if not user:
         return jsonify({"error": user_id + " not found"}), 404
     
-    top_3_video_ids = get_top_3(video_collection, users_collection, user, duration)
-    print(f"Returning top 3 video IDs: {top_3_video_ids}")
+    retrieval = request.headers.get('retrieval', default_retrieval)
+    top_3_video_ids = get_top_3(get_collection('videos'), get_collection('users'), user, duration, retrieval)
+    logger.debug("Returning top 3 video IDs: %s", top_3_video_ids)
     return jsonify({"top3VideoIds": top_3_video_ids})
 
+@app.route('/api/top3_batch', methods=['GET'])
+def get_top_3_batch_videos():
+    #Comma-separated userIds and durations; every user gets a top 3 for every duration
+    user_ids = [u for u in request.headers.get('userIds', request.headers.get('userId', '')).split(',') if u]
+    durations = [int(d) for d in request.headers.get('durations', request.headers.get('duration', '')).split(',') if d]
+    if not user_ids or not durations:
+        return jsonify({"error": "userIds and durations are required"}), 400
+    with timed_stage('mongo_fetch'):
+        users = list(get_collection('users').find({"_id": {"$in": [ObjectId(u) for u in user_ids]}}, user_profile_projection))
+    missing = set(user_ids) - {str(user["_id"]) for user in users}
+    if missing:
+        return jsonify({"error": ', '.join(sorted(missing)) + " not found"}), 404
+
+    retrieval = request.headers.get('retrieval', default_retrieval)
+    results = get_top_3_batch(get_collection('videos'), get_collection('users'), users, durations, retrieval)
+    return jsonify({"recommendations": [
+        {"userId": str(user_id), "duration": duration, "top3VideoIds": top_3}
+        for (user_id, duration), top_3 in results.items()
+    ]})
+
 @app.route('/api/rate_video', methods=['POST'])
 def rate_video():
     try:
@@ -34,76 +87,109 @@ def rate_video():
         video_id = request.headers.get('videoId')
         rating = request.headers.get('rating')
         
-        print(f"Received rating request: user_id={user_id}, video_id={video_id}, rating={rating}")
+        logger.debug("Received rating request: user_id=%s, video_id=%s, rating=%s", user_id, video_id, rating)
         
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
-        video = video_collection.find_one({"video_id": video_id})
+        with timed_stage('mongo_fetch'):
+            user = get_collection('users').find_one({"_id": ObjectId(user_id)}, {"_id": 1})
+            video = get_collection('videos').find_one({"video_id": video_id}, {"_id": 1})
         
         if not user or not video:
-            print(f"User or video not found: user={user}, video={video}")
+            logger.info("User or video not found: user_id=%s, video_id=%s", user_id, video_id)
             return jsonify({"error": "User or video not found"}), 404
         
-        new_avg, new_total = update_average_video_embedding(user['average_video'], user['total_ratings'], video, rating)
-        
-        print(f"Updated average: {new_avg}")
-        print(f"New total ratings: {new_total}")
-        
-        users_collection.update_one({"_id": ObjectId(user_id)}, {"$set": {"average_video": new_avg, "total_ratings": new_total, "total_videos": user['total_videos'] + 1}})
-        return jsonify({"message": "Rating updated successfully"})
+        with timed_stage('write_back'):
+            event = record_rating(get_database(), ObjectId(user_id), video_id, rating)
+        aggregator = get_rating_aggregator()
+
+        #Callers that need the profile updated before the response can ask for a synchronous flush;
+        #if the event still can't be applied it stays queued and the usual 202 is returned
+        if request.headers.get('sync') == 'true' and aggregator.flush_event(event['_id']):
+            return jsonify({"message": "Rating updated successfully"})
+        return jsonify({"message": "Rating recorded"}), 202
     except Exception as e:
-        print(f"Error in rate_video: {str(e)}")
+        logger.exception("Error in rate_video: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/flush_ratings', methods=['POST'])
+def flush_ratings():
+    applied = get_rating_aggregator().flush()
+    return jsonify({"message": "Ratings flushed", "events": applied})
+
+@app.route('/api/recommendation_cache_stats', methods=['GET'])
+def recommendation_cache_stats():
+    return jsonify(get_recommendation_cache().report())
+
 @app.route('/api/video_info', methods=['GET'])
 def video_info():
     video_id = request.headers.get('videoId')
-    print(video_id)
-    video = video_collection.find_one({"video_id": video_id})
+    with timed_stage('mongo_fetch'):
+        video = get_collection('videos').find_one({"video_id": video_id}, video_info_projection)
     if not video:
         return jsonify({"error": "Video not found"}), 404
-    output = {'title': video['title'].replace("&#39;", "'"), 'description': video['description'].replace("&#39;", "'"), 'channelTitle': video['channel_title'].replace("&#39;", "'")}
-    print(output)
-    return jsonify(output)
+    return jsonify(video_info_output(video))
+
+@app.route('/api/video_info_batch', methods=['GET'])
+def video_info_batch():
+    #Comma-separated videoIds, resolved with a single query
+    video_ids = [v for v in request.headers.get('videoIds', '').split(',') if v]
+    if not video_ids:
+        return jsonify({"error": "videoIds not provided"}), 400
+    with timed_stage('mongo_fetch'):
+        videos = {video['video_id']: video for video in get_collection('videos').find({"video_id": {"$in": video_ids}}, dict(video_info_projection, video_id=1))}
+    return jsonify({
+        "videos": {video_id: video_info_output(videos[video_id]) for video_id in video_ids if video_id in videos},
+        "missing": [video_id for video_id in video_ids if video_id not in videos],
+    })
+
+def video_info_output(video):
+    return {'title': video['title'].replace("&#39;", "'"), 'description': video['description'].replace("&#39;", "'"), 'channelTitle': video['channel_title'].replace("&#39;", "'")}
 
 @app.route('/api/add_to_queue', methods=['POST'])
 def add_to_queue():
     user_id = request.headers.get('userId')
     video_id = request.headers.get('videoId')
-    user = users_collection.find_one({ "_id": ObjectId(user_id) })
-    video = video_collection.find_one({"video_id": video_id})
+    user = get_collection('users').find_one({ "_id": ObjectId(user_id) }, {"_id": 1})
+    video = get_collection('videos').find_one({"video_id": video_id}, {"_id": 0, "video_id": 1, "title": 1})
     if not user:
         return jsonify({"error": "User not found"}), 404
     if not video:
         return jsonify({"error": "Video not found"}), 404
-    queue_colection.insert_one({"user_id": user_id, "video": video, "timestamp": datetime.now()})
+    with timed_stage('write_back'):
+        queue_video(get_collection('rating_queue'), user_id, video)
     
     return jsonify({"message": "Video added to queue successfully"})
 
 @app.route('/api/get_queue', methods=['GET'])
 def get_queue():
     user_id = request.headers.get('userId')
-    user = users_collection.find_one({ "_id": ObjectId(user_id) })
+    user = get_collection('users').find_one({ "_id": ObjectId(user_id) }, {"_id": 1})
     if not user:
         return jsonify({"error": "User not found"}, 404)
-    videos = list(queue_colection.find({"user_id": user_id}).sort("timestamp", 1))
-    simplified_videos = [{"video_id": v["video"]["video_id"], "title": v["video"]["title"]} for v in videos]
-    return jsonify(simplified_videos)
+
+    #Without a limit header the whole queue is returned, as before
+    limit = int(request.headers.get('limit', 0)) or None
+    with timed_stage('mongo_fetch'):
+        simplified_videos, next_cursor = get_queue_page(get_collection('rating_queue'), user_id, limit, request.headers.get('cursor'))
+    response = jsonify(simplified_videos)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @app.route('/api/remove_from_queue', methods=['POST'])
 def remove_from_queue():
     user_id = request.headers.get('userId')
     video_id = request.headers.get('videoId')
     
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    with timed_stage('write_back'):
+        removed = unqueue_video(get_collection('rating_queue'), user_id, video_id)
+    if removed:
+        return jsonify({"message": "Video removed from queue successfully"})
+
+    #Only a failed removal pays for the user lookup, to pick the right error
+    user = get_collection('users').find_one({"_id": ObjectId(user_id)}, {"_id": 1})
     if not user:
         return jsonify({"error": "User not found"}), 404
-
-    video = queue_colection.find_one({"user_id": user_id, "video.video_id": video_id})
-    if not video:
-        return jsonify({"error": "Video not found in user's queue"}), 404
-
-    queue_colection.delete_one({"user_id": user_id, "video.video_id": video_id})
-    return jsonify({"message": "Video removed from queue successfully"})
+    return jsonify({"error": "Video not found in user's queue"}), 404
 
 
 if __name__ == '__main__':
@@ -0,0 +1,21 @@
+from datetime import datetime
+from providers import get_collection
+
+# Older ingests stored the video length as 'duration' while get_top_3 filters on
+# 'duration_in_seconds'. Renames the field in place; safe to rerun.
+# Usage: python backfill_duration.py
+
+def backfill_duration(video_collection):
+    renamed = video_collection.update_many(
+        {'duration': {'$exists': True}, 'duration_in_seconds': {'$exists': False}},
+        {'$rename': {'duration': 'duration_in_seconds'}, '$set': {'updated_at': datetime.now()}}
+    )
+    dropped = video_collection.update_many(
+        {'duration': {'$exists': True}, 'duration_in_seconds': {'$exists': True}},
+        {'$unset': {'duration': ''}}
+    )
+    return renamed.modified_count, dropped.modified_count
+
+if __name__ == '__main__':
+    renamed, dropped = backfill_duration(get_collection('videos'))
+    print(f"Renamed duration on {renamed} videos, removed stale duration from {dropped}")
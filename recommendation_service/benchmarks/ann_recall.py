@@ -0,0 +1,78 @@
+import os
+import time
+import numpy as np
+from ann_index import IVFIndex, fuse, fuse_query, ann_candidates, ann_probe
+from benchmarks.common import percentile, write_report
+from scoring import interest_weights, normalize_rows, weighted_cosine_scores, top_k
+
+# Recall@3 and latency of ANN retrieval + exact rerank against exact scoring over the
+# whole duration window, on clustered synthetic embeddings held in memory.
+# Run from recommendation_service/: python -m benchmarks.ann_recall
+# BENCH_SIZES=10000,100000,1000000 reproduces the full table (1M needs ~16 GB at 768-d).
+
+sizes = [int(s) for s in os.getenv("BENCH_SIZES", "10000,100000").split(",")]
+dim = int(os.getenv("BENCH_DIM", "768"))
+num_queries = int(os.getenv("BENCH_QUERIES", "100"))
+num_topics = 200
+tolerance = 150
+
+def synthetic_catalogue(size, rng, topics):
+    topic = rng.integers(0, len(topics), size)
+    matrices = {}
+    for feature in interest_weights:
+        matrix = topics[topic] + 0.8 * rng.standard_normal((size, dim)).astype(np.float32)
+        mask = rng.random(size) > 0.3 if feature == 'tags' else np.ones(size, dtype=bool)
+        matrices[feature] = (normalize_rows(matrix * mask[:, None]), mask)
+    durations = rng.integers(60, 3600, size).astype(np.int32)
+    return matrices, durations
+
+def run_size(size, rng):
+    topics = rng.standard_normal((num_topics, dim)).astype(np.float32)
+    matrices, durations = synthetic_catalogue(size, rng, topics)
+    ids = np.array([f'vid{i:08d}' for i in range(size)])
+
+    start = time.perf_counter()
+    index = IVFIndex.build(ids.tolist(), fuse(matrices, interest_weights), durations)
+    build_seconds = time.perf_counter() - start
+
+    exact_times, ann_times, recalls = [], [], []
+    for _ in range(num_queries):
+        interest = topics[rng.integers(num_topics)] + 0.5 * rng.standard_normal(dim).astype(np.float32)
+        queries = {feature: interest for feature in interest_weights}
+        target = int(rng.integers(5, 50)) * 60
+        window = (durations >= target - tolerance) & (durations <= target + tolerance)
+
+        start = time.perf_counter()
+        rows = np.flatnonzero(window)
+        window_matrices = {f: (m[rows], mask[rows]) for f, (m, mask) in matrices.items()}
+        exact = top_k(weighted_cosine_scores(queries, window_matrices, interest_weights), ids[rows].tolist(), 3)
+        exact_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        candidate_ids = index.search(fuse_query(queries, interest_weights), ann_candidates, ann_probe, (target - tolerance, target + tolerance))
+        rows = np.array([index.row_of[v] for v in candidate_ids], dtype=np.int64)
+        candidate_matrices = {f: (m[rows], mask[rows]) for f, (m, mask) in matrices.items()}
+        approx = top_k(weighted_cosine_scores(queries, candidate_matrices, interest_weights), candidate_ids, 3)
+        ann_times.append(time.perf_counter() - start)
+
+        if exact:
+            recalls.append(len({v for _, v in exact} & {v for _, v in approx}) / len(exact))
+
+    return {
+        "videos": size,
+        "lists": len(index.centroids),
+        "build_seconds": build_seconds,
+        "recall_at_3": float(np.mean(recalls)) if recalls else None,
+        "exact_p50_ms": percentile(exact_times, 50) * 1000,
+        "exact_p99_ms": percentile(exact_times, 99) * 1000,
+        "ann_p50_ms": percentile(ann_times, 50) * 1000,
+        "ann_p99_ms": percentile(ann_times, 99) * 1000,
+    }
+
+def main():
+    rng = np.random.default_rng(0)
+    results = [run_size(size, rng) for size in sizes]
+    write_report({"benchmark": "ann_recall", "dim": dim, "candidates": ann_candidates, "probe": ann_probe, "results": results}, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import os
+import time
+import bson
+from benchmarks.common import get_benchmark_database, insert_synthetic_videos, percentile, write_report
+from indexes import candidate_projection, candidate_batch_size
+
+# Bytes transferred and latency of the /api/top3 candidate query, unprojected
+# (the old list(find(...))) versus projected and streamed in bounded batches.
+# Run from recommendation_service/: python -m benchmarks.candidate_query
+
+corpus_size = int(os.getenv("BENCH_VIDEOS", "5000"))
+repeats = int(os.getenv("BENCH_REPEATS", "10"))
+
+def candidate_query(duration_minutes, tolerance=150):
+    target = duration_minutes * 60
+    return {"video_id": {"$nin": []}, "duration_in_seconds": {"$gte": target - tolerance, "$lte": target + tolerance}}
+
+def run(fetch):
+    timings = []
+    transferred = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        transferred = sum(len(bson.encode(doc)) for doc in fetch())
+        timings.append(time.perf_counter() - start)
+    return {"bytes": transferred, "p50_ms": percentile(timings, 50) * 1000, "p99_ms": percentile(timings, 99) * 1000}
+
+def main():
+    db = get_benchmark_database()
+    insert_synthetic_videos(db, corpus_size)
+    videos = db['videos']
+    query = candidate_query(20)
+
+    before = run(lambda: list(videos.find(query)))
+    after = run(lambda: videos.find(query, candidate_projection).batch_size(candidate_batch_size))
+    write_report({"benchmark": "candidate_query", "videos": corpus_size, "before": before, "after": after}, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
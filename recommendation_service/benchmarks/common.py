@@ -0,0 +1,65 @@
+import json
+import os
+import numpy as np
+
+# Shared helpers for the benchmark scripts. Set MONGO_URI to run against a real
+# mongod; otherwise an in-memory mongomock database is used.
+
+embedding_dim = 768
+embedded_fields = ['title_embedded', 'description_embedded', 'channel_title_embedded', 'tags_embedded', 'category_embedded']
+
+def get_benchmark_database(name='sparetime_benchmark'):
+    import providers
+    if os.getenv("MONGO_URI"):
+        import pymongo
+        client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+        client.drop_database(name)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    providers.mongo_client = client
+    providers.database_name = name
+    from indexes import ensure_indexes
+    ensure_indexes(client[name])
+    return client[name]
+
+def random_embedding(rng, dim=embedding_dim):
+    # BERT mean-pooled vectors share a strong common direction; mimic that so
+    # cosine similarities land in a realistic range instead of around zero
+    return (0.6 * rng.standard_normal(dim) + 0.4).astype(np.float32)
+
+def synthetic_video(index, rng, dim=embedding_dim):
+    from embedding_storage import encode_embedding
+    has_tags = rng.random() > 0.3
+    video = {
+        'video_id': f'vid{index:08d}',
+        'title': f'Synthetic video {index}',
+        'description': 'Synthetic description ' * 20,
+        'channel_title': f'Channel {index % 500}',
+        'channel_id': f'channel{index % 500}',
+        'thumbnails': {'default': {'url': f'https://i.ytimg.com/vi/vid{index}/default.jpg', 'width': 120, 'height': 90}},
+        'tags': ['synthetic', 'benchmark'] if has_tags else [],
+        'category': f'Category {index % 50}',
+        'duration_in_seconds': int(rng.integers(60, 3600)),
+    }
+    for field in embedded_fields:
+        if field == 'tags_embedded' and not has_tags:
+            video[field] = []
+        else:
+            video[field] = encode_embedding(random_embedding(rng, dim))
+    return video
+
+def insert_synthetic_videos(db, count, seed=0, dim=embedding_dim, batch=1000):
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, batch):
+        db['videos'].insert_many([synthetic_video(i, rng, dim) for i in range(start, min(count, start + batch))])
+
+def percentile(values, pct):
+    return float(np.percentile(np.asarray(values), pct)) if values else 0.0
+
+def write_report(report, path=None):
+    text = json.dumps(report, indent=2)
+    print(text)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text)
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+from benchmarks.common import get_benchmark_database, write_report
+from benchmarks.embedding_batching import synthetic_texts
+from benchmarks.fakes import stub_embeddings
+import embedding_storage
+import reembed_videos
+
+# Two parts:
+# - backends: the lowest cosine similarity of each embedding backend to the reference
+#   make_embedding output (checked against embedding.backend_min_cosine), and
+#   sentences/sec on one core and on every core. Needs the BERT weights; onnx also
+#   needs onnxruntime. Set BENCH_BACKENDS= to skip.
+# - backfill: end-to-end reembed_videos.reembed over a synthetic corpus of BENCH_VIDEOS
+#   videos with BENCH_WORKERS processes. BENCH_STUB=1 swaps the model for
+#   deterministic stub vectors to time everything but inference. More than one worker
+#   needs MONGO_URI, since mongomock is private to each process.
+# Run from recommendation_service/: python -m benchmarks.embedding_backends
+
+backends = [name for name in os.getenv("BENCH_BACKENDS", "torch,torch-int8,onnx").split(',') if name]
+num_texts = int(os.getenv("BENCH_TEXTS", "200"))
+corpus_size = int(os.getenv("BENCH_VIDEOS", "100000"))
+workers = int(os.getenv("BENCH_WORKERS", str(os.cpu_count() or 1)))
+use_stub = os.getenv("BENCH_STUB") == "1"
+chunk_size = 256
+
+def backend_report(backend, texts):
+    from embedding import backend_min_cosine, check_backend, make_embeddings
+
+    min_cosine, ok = check_backend(texts, backend)
+    rates = {}
+    for threads in [1, os.cpu_count() or 1]:
+        make_embeddings(texts[:8], num_threads=threads, backend=backend)
+        start = time.perf_counter()
+        make_embeddings(texts, num_threads=threads, backend=backend)
+        rates[threads] = len(texts) / (time.perf_counter() - start)
+    cores = os.cpu_count() or 1
+    return {
+        'backend': backend,
+        'min_cosine': min_cosine,
+        'tolerance': backend_min_cosine.get(backend),
+        'within_tolerance': ok,
+        'sentences_per_second_one_core': rates[1],
+        'sentences_per_second_all_cores': rates[cores],
+        'sentences_per_second_per_core': rates[cores] / cores,
+    }
+
+def unembedded_video(index):
+    # Only the text the job reads; the stale vectors it replaces don't affect its cost
+    return {
+        'video_id': f'vid{index:08d}',
+        'title': f'Synthetic video {index}',
+        'description': f'Synthetic description of video {index} ' * 10,
+        'channel_title': f'Channel {index % 500}',
+        'tags': ['synthetic', 'benchmark'] if index % 3 else [],
+        'category': f'Category {index % 50}',
+        'embedding_model_version': 'previous-model',
+    }
+
+def backfill_report():
+    bench_workers = workers if os.getenv("MONGO_URI") else 1
+    db = get_benchmark_database()
+    for start in range(0, corpus_size, 10000):
+        db['videos'].insert_many([unembedded_video(i) for i in range(start, min(corpus_size, start + 10000))])
+    # Binary blobs keep a 100k-video mongomock corpus in memory
+    embedding_storage.embedding_storage = 'float32'
+
+    stats = reembed_videos.reembed(bench_workers, chunk_size, embed_fn=stub_embeddings if use_stub else None, progress_interval=float('inf'))
+    remaining = db['videos'].count_documents(reembed_videos.pending_query())
+    return {'videos': corpus_size, 'workers': bench_workers, 'stub_model': use_stub, 'remaining': remaining, **stats}
+
+def main():
+    report = {'benchmark': 'embedding_backends', 'cores': os.cpu_count(), 'backends': []}
+    texts = synthetic_texts(num_texts)
+    for backend in backends:
+        try:
+            report['backends'].append(backend_report(backend, texts))
+        except (ImportError, ValueError) as e:
+            report['backends'].append({'backend': backend, 'skipped': str(e)})
+    report['backfill'] = backfill_report()
+    write_report(report)
+
+    failed = [entry['backend'] for entry in report['backends'] if entry.get('within_tolerance') is False]
+    if failed or report['backfill']['remaining']:
+        print(f"outside tolerance: {failed}, videos left unembedded: {report['backfill']['remaining']}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
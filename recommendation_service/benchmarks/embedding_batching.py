@@ -0,0 +1,46 @@
+import json
+import os
+import random
+import sys
+import time
+import numpy as np
+from embedding import make_embedding, make_embeddings
+
+# Compares length-bucketed batch embedding with the single-item path.
+# Needs the BERT weights. Run from recommendation_service/: python -m benchmarks.embedding_batching
+
+tolerance = 1e-4
+num_texts = int(os.getenv("BENCH_TEXTS", "200"))
+batch_sizes = [8, 32, 64]
+
+words = ("machine learning investing stock market neural network cooking recipe "
+         "politics climate energy portfolio transformer vision robotics finance").split()
+
+def synthetic_texts(count, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(words) for _ in range(rng.choice([3, 8, 20, 60, 200]))) for _ in range(count)]
+
+def main():
+    texts = synthetic_texts(num_texts)
+
+    start = time.perf_counter()
+    single = np.stack([make_embedding(text).numpy().reshape(-1) for text in texts])
+    single_seconds = time.perf_counter() - start
+
+    report = {"benchmark": "embedding_batching", "texts": num_texts, "single_texts_per_second": num_texts / single_seconds, "batched": []}
+    failed = False
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        batched = make_embeddings(texts, batch_size=batch_size)
+        seconds = time.perf_counter() - start
+        max_abs_diff = float(np.abs(batched - single).max())
+        failed = failed or max_abs_diff > tolerance
+        report["batched"].append({"batch_size": batch_size, "texts_per_second": num_texts / seconds, "max_abs_diff": max_abs_diff})
+
+    print(json.dumps(report, indent=2))
+    if failed:
+        print(f"batched embeddings differ from make_embedding by more than {tolerance}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+
+# Local stand-in for the googleapiclient YouTube resource, so the ingestion pipeline
+# can run without an API key. Results are deterministic per query; latency and
+# transient failures can be injected to exercise concurrency and retries.
+
+class FakeRequest:
+    def __init__(self, client, handler, params):
+        self.client = client
+        self.handler = handler
+        self.params = params
+
+    def execute(self):
+        self.client.record(self.handler.__name__)
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        if self.client.failure_rate and self.client.rng.random() < self.client.failure_rate:
+            raise ConnectionError('injected YouTube API failure')
+        return self.handler(**self.params)
+
+class FakeResource:
+    def __init__(self, client, handler):
+        self.client = client
+        self.handler = handler
+
+    def list(self, **params):
+        return FakeRequest(self.client, self.handler, params)
+
+class FakeYouTube:
+    def __init__(self, results_per_query=500, catalogue_size=5000, latency=0.0, failure_rate=0.0, seed=0):
+        self.results_per_query = results_per_query
+        self.catalogue_size = catalogue_size
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def record(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def search(self):
+        return FakeResource(self, self.search_list)
+
+    def videos(self):
+        return FakeResource(self, self.videos_list)
+
+    def video_number(self, query, position):
+        # Overlapping queries share part of the catalogue, like real search results
+        return (sum(map(ord, query)) * 31 + position) % self.catalogue_size
+
+    def search_list(self, q, maxResults, pageToken=None, **params):
+        offset = int(pageToken or 0)
+        stop = min(offset + min(maxResults, 50), self.results_per_query)
+        items = [self.search_item(self.video_number(q, position)) for position in range(offset, stop)]
+        response = {'items': items}
+        if stop < self.results_per_query:
+            response['nextPageToken'] = str(stop)
+        return response
+
+    def videos_list(self, part, id):
+        ids = id.split(',')
+        if len(ids) > 50:
+            raise ValueError('videos.list accepts at most 50 ids')
+        return {'items': [self.video_item(video_id) for video_id in ids]}
+
+    def search_item(self, number):
+        return {
+            'id': {'videoId': f'fake{number:07d}'},
+            'snippet': {
+                'title': f'Fake video {number}',
+                'description': f'Short description of fake video {number}',
+                'publishedAt': '2024-01-01T00:00:00Z',
+                'channelTitle': f'Fake channel {number % 97}',
+                'channelId': f'fakechannel{number % 97}',
+                'thumbnails': {'default': {'url': f'https://i.ytimg.com/vi/fake{number}/default.jpg'}},
+            },
+        }
+
+    def video_item(self, video_id):
+        number = int(video_id[4:])
+        return {
+            'id': video_id,
+            'snippet': {
+                'description': f'Full description of fake video {number} ' * 5,
+                'tags': [f'tag{number % 13}', f'tag{number % 7}'] if number % 3 else [],
+                'defaultAudioLanguage': 'en',
+            },
+            'contentDetails': {
+                'duration': f'PT{number % 59}M{number % 60}S',
+                'definition': 'hd',
+                'dimension': '2d',
+                'licensedContent': True,
+            },
+        }
+
+def stub_embeddings(texts, batch_size=None, num_threads=None, dim=768):
+    # Drop-in for embedding.make_embeddings without BERT weights: deterministic
+    # 768-d vectors seeded from the text, with a shared offset like mean-pooled BERT
+    import hashlib
+    import numpy as np
+    from embedding import embedding_text
+    rows = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        seed = int.from_bytes(hashlib.sha256(embedding_text(text).encode('utf-8')).digest()[:8], 'little')
+        rows[i] = 0.6 * np.random.default_rng(seed).standard_normal(dim) + 0.4
+    return rows
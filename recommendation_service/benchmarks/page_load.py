@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+import numpy as np
+from bson import ObjectId
+from pymongo import monitoring
+from benchmarks.common import get_benchmark_database, insert_synthetic_videos, random_embedding, percentile, write_report
+from embedding_storage import encode_embedding
+import model
+import recommendation_cache
+
+# One home page load that prefetches recommendations for several durations, done the
+# old way (one /api/top3 per duration, then one /api/video_info per video) and through
+# /api/top3_batch plus /api/video_info_batch. Reports HTTP round trips, server CPU and
+# wall time per page load, and Mongo commands when run against a real mongod (MONGO_URI).
+# Run from recommendation_service/: python -m benchmarks.page_load
+
+corpus_size = int(os.getenv("BENCH_VIDEOS", "5000"))
+durations = [int(d) for d in os.getenv("BENCH_DURATIONS", "5,10,20,30").split(",")]
+page_loads = int(os.getenv("BENCH_PAGE_LOADS", "10"))
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        with self.lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def make_user(db, rng):
+    interests = ['machine learning', 'investing']
+    user = {
+        '_id': ObjectId(),
+        'interests': interests,
+        'interest_embedding': {'key': model.interest_embedding_key(interests), 'embedding': encode_embedding(random_embedding(rng))},
+        'average_video': {f: encode_embedding(random_embedding(rng)) for f in ['title', 'description', 'channel_title', 'category']},
+        'total_ratings': 3.0,
+        'total_videos': 5,
+    }
+    db['users'].insert_one(user)
+    return str(user['_id'])
+
+def page_load_individual(client, user_id):
+    requests = 0
+    video_ids = []
+    for duration in durations:
+        response = client.get('/api/top3', headers={'userId': user_id, 'duration': str(duration)})
+        requests += 1
+        video_ids.extend(response.json['top3VideoIds'])
+    for video_id in video_ids:
+        client.get('/api/video_info', headers={'videoId': video_id})
+        requests += 1
+    return requests
+
+def page_load_batched(client, user_id):
+    response = client.get('/api/top3_batch', headers={'userIds': user_id, 'durations': ','.join(map(str, durations))})
+    video_ids = [video_id for entry in response.json['recommendations'] for video_id in entry['top3VideoIds']]
+    client.get('/api/video_info_batch', headers={'videoIds': ','.join(video_ids)})
+    return 2
+
+def measure(client, db, page_load, counter, rng):
+    wall, cpu, commands = [], [], []
+    requests = 0
+    for _ in range(page_loads):
+        user_id = make_user(db, rng)
+        # Cold page loads: nothing cached for this user yet
+        recommendation_cache.recommendation_cache = recommendation_cache.RecommendationCache()
+        before = counter.count
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        requests = page_load(client, user_id)
+        cpu.append(time.process_time() - cpu_start)
+        wall.append(time.perf_counter() - wall_start)
+        commands.append(counter.count - before)
+    return {
+        "http_round_trips": requests,
+        "mongo_commands": float(np.mean(commands)) if os.getenv("MONGO_URI") else None,
+        "wall_p50_ms": percentile(wall, 50) * 1000,
+        "cpu_p50_ms": percentile(cpu, 50) * 1000,
+    }
+
+def main():
+    counter = CommandCounter()
+    monitoring.register(counter)
+    db = get_benchmark_database()
+    insert_synthetic_videos(db, corpus_size)
+    from app import app
+    client = app.test_client()
+    rng = np.random.default_rng(0)
+
+    write_report({
+        "benchmark": "page_load",
+        "videos": corpus_size,
+        "durations": durations,
+        "candidate_source": model.candidate_source,
+        "individual": measure(client, db, page_load_individual, counter, rng),
+        "batched": measure(client, db, page_load_batched, counter, rng),
+    }, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
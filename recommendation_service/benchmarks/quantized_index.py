@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import numpy as np
+from benchmarks.common import get_benchmark_database, insert_synthetic_videos, random_embedding, write_report
+from embedding_storage import encode_embedding
+from scoring import interest_weights, ratings_weights, weighted_cosine_score_matrix
+from serving_index import CatalogueIndex
+import model
+
+# Memory per video, scoring throughput and ranking agreement of the quantized serving
+# index (int8 and float16 with an exact float32 rerank of the shortlist) against the
+# float32 index. Agreement is overlap of the top-20 interest and ratings lists with
+# the exact ones, with and without the rerank.
+# Run from recommendation_service/: python -m benchmarks.quantized_index
+
+corpus_size = int(os.getenv("BENCH_VIDEOS", "20000"))
+num_users = int(os.getenv("BENCH_USERS", "50"))
+repeats = int(os.getenv("BENCH_REPEATS", "5"))
+num_vids = 20
+tolerance = model.duration_tolerance
+
+def python_list_bytes_per_video(dim=768, features=5):
+    # What a video's embeddings cost as decoded BSON arrays of Python floats
+    vector = [float(x) for x in np.zeros(dim) + 0.5]
+    return features * (sys.getsizeof(vector) + sum(sys.getsizeof(x) for x in vector))
+
+def make_users(rng):
+    return [{
+        '_id': i,
+        'interests': ['synthetic'],
+        'average_video': {feature: encode_embedding(random_embedding(rng)) for feature in ratings_weights},
+        'total_videos': 5,
+    } for i in range(num_users)]
+
+def scoring_throughput(index, query_sets):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        weighted_cosine_score_matrix(query_sets, index.matrices, interest_weights)
+        best = min(best, time.perf_counter() - start)
+    return len(index) * len(query_sets) / best
+
+def overlap(a, b):
+    return len({video_id for _, video_id in a} & {video_id for _, video_id in b}) / max(len(a), 1)
+
+def agreement(exact_index, index, db, users, interest_embeddings, rng):
+    reranked, shortlist_only, identical = [], [], 0
+    for user, embedding in zip(users, interest_embeddings):
+        target = int(rng.integers(300, 3300))
+        expected = model.rank_window(exact_index, user, target, tolerance, num_vids, embedding, True, None, frozenset(), db['videos'])
+        got = model.rank_window(index, user, target, tolerance, num_vids, embedding, True, None, frozenset(), db['videos'])
+        start, stop = index.window(target, tolerance)
+        ids, matrices = index.candidates(start, stop)
+        approximate = (model.interest_video_similarity(user, None, num_vids, (ids, matrices), embedding),
+                       model.ratings_video_similarity(user, None, num_vids, (ids, matrices)))
+        for exact_list, reranked_list, approximate_list in zip(expected, got, approximate):
+            reranked.append(overlap(exact_list, reranked_list))
+            shortlist_only.append(overlap(exact_list, approximate_list))
+            identical += [v for _, v in exact_list] == [v for _, v in reranked_list]
+    return {
+        "top20_overlap_reranked": float(np.mean(reranked)),
+        "top20_overlap_without_rerank": float(np.mean(shortlist_only)),
+        "identical_lists_reranked": identical / len(reranked),
+    }
+
+def main():
+    db = get_benchmark_database()
+    insert_synthetic_videos(db, corpus_size)
+    rng = np.random.default_rng(0)
+    users = make_users(rng)
+    interest_embeddings = [random_embedding(rng) for _ in users]
+    query_sets = [{feature: embedding for feature in interest_weights} for embedding in interest_embeddings[:8]]
+
+    exact_index = CatalogueIndex.from_collection(db['videos'])
+    report = {
+        "benchmark": "quantized_index",
+        "videos": corpus_size,
+        "python_list_bytes_per_video": python_list_bytes_per_video(),
+        "float32": {
+            "bytes_per_video": exact_index.nbytes() / corpus_size,
+            "videos_scored_per_second": scoring_throughput(exact_index, query_sets),
+        },
+    }
+    for precision in ['float16', 'int8']:
+        # Built the way CANDIDATE_SOURCE=memory builds it; the rerank reads float32 rows from Mongo
+        index = CatalogueIndex.from_collection(db['videos'], precision=precision)
+        report[precision] = {
+            "bytes_per_video": index.nbytes() / corpus_size,
+            "videos_scored_per_second": scoring_throughput(index, query_sets),
+            **agreement(exact_index, index, db, users, interest_embeddings, np.random.default_rng(1)),
+        }
+    write_report(report, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
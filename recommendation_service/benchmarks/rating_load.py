@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+import numpy as np
+from bson import ObjectId
+from benchmarks.common import get_benchmark_database, insert_synthetic_videos, percentile, write_report
+from rating_events import RatingAggregator, record_rating
+
+# Load generator for the rating event log: writer threads append ratings as fast as
+# they can while a RatingAggregator folds them in the background. Reports sustained
+# ratings/sec accepted and applied, and how stale the oldest event was at each flush.
+# Run from recommendation_service/: python -m benchmarks.rating_load
+
+num_users = int(os.getenv("BENCH_USERS", "200"))
+num_videos = int(os.getenv("BENCH_VIDEOS", "500"))
+num_writers = int(os.getenv("BENCH_WRITERS", "4"))
+duration_seconds = float(os.getenv("BENCH_SECONDS", "10"))
+flush_interval = float(os.getenv("RATING_FLUSH_INTERVAL", "0.5"))
+
+def writer(db, user_ids, stop, counts, index):
+    rng = np.random.default_rng(index)
+    while not stop.is_set():
+        record_rating(db, user_ids[rng.integers(len(user_ids))], f'vid{rng.integers(num_videos):08d}', rng.integers(5, 11))
+        counts[index] += 1
+
+def main():
+    db = get_benchmark_database()
+    insert_synthetic_videos(db, num_videos)
+    user_ids = [ObjectId() for _ in range(num_users)]
+    empty = {'title': [], 'description': [], 'channel_title': [], 'category': []}
+    db['users'].insert_many([{'_id': u, 'average_video': dict(empty), 'total_ratings': 0, 'total_videos': 0} for u in user_ids])
+
+    aggregator = RatingAggregator(db, flush_interval)
+    staleness = []
+    original_apply = aggregator.apply
+    def apply(events, token):
+        original_apply(events, token)
+        staleness.append(aggregator.stats['last_staleness_seconds'])
+    aggregator.apply = apply
+    aggregator.start()
+
+    stop = threading.Event()
+    counts = [0] * num_writers
+    threads = [threading.Thread(target=writer, args=(db, user_ids, stop, counts, i)) for i in range(num_writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration_seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    aggregator.stop()
+    aggregator.flush()
+
+    write_report({
+        "benchmark": "rating_load",
+        "users": num_users,
+        "writers": num_writers,
+        "flush_interval_seconds": flush_interval,
+        "ratings_recorded": sum(counts),
+        "ratings_per_second": sum(counts) / elapsed,
+        "events_applied": aggregator.stats['events_applied'],
+        "conflicts": aggregator.stats['conflicts'],
+        "staleness_p50_seconds": percentile(staleness, 50),
+        "staleness_p99_seconds": percentile(staleness, 99),
+    }, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import os
+import time
+import bson
+from benchmarks.common import get_benchmark_database, insert_synthetic_videos, percentile, write_report
+from rating_queue import add_to_queue, get_queue_page, remove_from_queue, migrate_legacy_queue
+
+# rating_queue storage per entry and get_queue latency for users with long queues,
+# for the legacy full-copy entries, after migrate_legacy_queue, and paged.
+# Run from recommendation_service/: python -m benchmarks.rating_queue
+
+queue_sizes = [int(s) for s in os.getenv("BENCH_QUEUE_SIZES", "100,1000,5000").split(",")]
+page_size = int(os.getenv("BENCH_PAGE_SIZE", "50"))
+repeats = int(os.getenv("BENCH_REPEATS", "10"))
+
+def storage_bytes(queue):
+    return sum(len(bson.encode(entry)) for entry in queue.find({}))
+
+def time_full_queue(queue, user_id):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        get_queue_page(queue, user_id)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def time_first_page(queue, user_id):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        get_queue_page(queue, user_id, page_size)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def walk_pages(queue, user_id):
+    start = time.perf_counter()
+    pages, cursor, seen = 0, None, 0
+    while True:
+        videos, cursor = get_queue_page(queue, user_id, page_size, cursor)
+        pages += 1
+        seen += len(videos)
+        if not cursor:
+            return pages, seen, time.perf_counter() - start
+
+def main():
+    db = get_benchmark_database()
+    insert_synthetic_videos(db, max(queue_sizes))
+    videos = list(db['videos'].find({}).sort('video_id', 1))
+    runs = []
+    for size in queue_sizes:
+        queue = db['rating_queue']
+        queue.delete_many({})
+        user_id = f'user{size}'
+        queue.insert_many([{'user_id': user_id, 'video': dict(video), 'timestamp': video['_id'].generation_time.replace(tzinfo=None)} for video in videos[:size]])
+        legacy_bytes = storage_bytes(queue)
+        legacy_full = time_full_queue(queue, user_id)
+
+        start = time.perf_counter()
+        migrated = migrate_legacy_queue(queue)
+        migrate_seconds = time.perf_counter() - start
+        lean_bytes = storage_bytes(queue)
+        lean_full = time_full_queue(queue, user_id)
+        first_page = time_first_page(queue, user_id)
+        pages, walked, walk_seconds = walk_pages(queue, user_id)
+
+        add_to_queue(queue, user_id, videos[0])
+        start = time.perf_counter()
+        remove_from_queue(queue, user_id, videos[0]['video_id'])
+        remove_seconds = time.perf_counter() - start
+
+        runs.append({
+            "queue_size": size,
+            "legacy_bytes_per_entry": legacy_bytes / size,
+            "lean_bytes_per_entry": lean_bytes / size,
+            "migrated": migrated,
+            "migrate_seconds": migrate_seconds,
+            "legacy_get_queue_p50_ms": percentile(legacy_full, 50) * 1000,
+            "lean_get_queue_p50_ms": percentile(lean_full, 50) * 1000,
+            "first_page_p50_ms": percentile(first_page, 50) * 1000,
+            "pages": pages,
+            "entries_paged": walked,
+            "walk_all_pages_seconds": walk_seconds,
+            "remove_ms": remove_seconds * 1000,
+        })
+
+    write_report({"benchmark": "rating_queue", "page_size": page_size, "runs": runs}, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
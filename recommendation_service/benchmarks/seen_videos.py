@@ -0,0 +1,50 @@
+import os
+import time
+import numpy as np
+from benchmarks.common import get_benchmark_database, insert_synthetic_videos, random_embedding, percentile, write_report
+from embedding_storage import encode_embedding
+import model
+from seen_videos import mark_seen
+
+# get_top_3 latency as a user's seen history grows, with seen videos tracked in the
+# seen_videos collection and excluded by mask in the scorer.
+# Run from recommendation_service/: python -m benchmarks.seen_videos
+
+corpus_size = int(os.getenv("BENCH_VIDEOS", "5000"))
+seen_sizes = [int(s) for s in os.getenv("BENCH_SEEN_SIZES", "10,1000,50000").split(",")]
+repeats = int(os.getenv("BENCH_REPEATS", "10"))
+
+def make_user(db, index, rng):
+    interests = ['machine learning', 'investing']
+    user = {
+        '_id': index,
+        'interests': interests,
+        'interest_embedding': {'key': model.interest_embedding_key(interests), 'embedding': encode_embedding(random_embedding(rng))},
+        'average_video': {f: encode_embedding(random_embedding(rng)) for f in ['title', 'description', 'channel_title', 'category']},
+        'total_ratings': 3.0,
+        'total_videos': 5,
+    }
+    db['users'].insert_one(user)
+    return user
+
+def main():
+    db = get_benchmark_database()
+    insert_synthetic_videos(db, corpus_size)
+    rng = np.random.default_rng(1)
+
+    results = []
+    for index, seen_size in enumerate(seen_sizes):
+        user = make_user(db, index, rng)
+        # Histories larger than the corpus include ids of videos no longer in the catalogue
+        mark_seen(db['users'], user['_id'], [f'vid{i:08d}' for i in range(seen_size)])
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model.get_top_3(db['videos'], db['users'], user, 20)
+            timings.append(time.perf_counter() - start)
+        results.append({"seen": seen_size, "p50_ms": percentile(timings, 50) * 1000, "p99_ms": percentile(timings, 99) * 1000})
+
+    write_report({"benchmark": "seen_videos", "videos": corpus_size, "candidate_source": model.candidate_source, "results": results}, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import numpy as np
+from benchmarks.common import get_benchmark_database, insert_synthetic_videos, synthetic_video, write_report
+from catalogue import delete_videos
+import serving_index
+from serving_index import CatalogueIndex, LiveCatalogue
+
+# Cost of keeping the serving index current: a full reload of the videos collection
+# against incremental refreshes that pull small deltas (new, changed and deleted videos)
+# into a LiveCatalogue, plus the background compaction that folds the delta back in.
+# mongomock has no index on updated_at, so with it the delta query scans the
+# collection; set MONGO_URI for realistic refresh times on a large corpus.
+# Run from recommendation_service/: python -m benchmarks.serving_refresh
+
+corpus_size = int(os.getenv("BENCH_VIDEOS", "20000"))
+delta_sizes = [int(s) for s in os.getenv("BENCH_DELTA_SIZES", "10,100,1000").split(",")]
+precision = os.getenv("SERVING_PRECISION", "float32")
+
+def timed_with_peak(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+def main():
+    db = get_benchmark_database()
+    insert_synthetic_videos(db, corpus_size)
+    rng = np.random.default_rng(1)
+    # Single writer here, so no overlap is needed and each refresh pulls only its own delta
+    serving_index.serving_refresh_overlap = timedelta(0)
+
+    base, reload_seconds, reload_peak = timed_with_peak(lambda: CatalogueIndex.from_collection(db['videos'], precision=precision))
+    live = LiveCatalogue(db['videos'], base, refresh_interval=0)
+    live.refresh()
+
+    refreshes = []
+    next_id = corpus_size
+    for size in delta_sizes:
+        # Mostly inserts, with a few changed and deleted videos
+        videos = [synthetic_video(next_id + i, rng) for i in range(size)]
+        next_id += size
+        written_at = datetime.now()
+        for video in videos:
+            video['updated_at'] = written_at
+        db['videos'].insert_many(videos)
+        changed = [f'vid{i:08d}' for i in rng.choice(corpus_size, size=max(1, size // 10), replace=False)]
+        db['videos'].update_many({'video_id': {'$in': changed}}, {'$set': {'duration_in_seconds': 600, 'updated_at': datetime.now()}})
+        delete_videos(db, [f'vid{i:08d}' for i in rng.choice(corpus_size, size=max(1, size // 20), replace=False)])
+        pulled, seconds, peak = timed_with_peak(live.refresh)
+        refreshes.append({
+            "delta_videos": size,
+            "pulled": pulled,
+            "refresh_seconds": seconds,
+            "refresh_peak_bytes": peak,
+            "lag_seconds": (datetime.now() - written_at).total_seconds(),
+            "delta_rows": len(live.state.delta) if live.state.delta is not None else 0,
+            "tombstones": live.state.tombstones,
+        })
+
+    _, compact_seconds, compact_peak = timed_with_peak(live.compact)
+    write_report({
+        "benchmark": "serving_refresh",
+        "videos": corpus_size,
+        "precision": precision,
+        "full_reload_seconds": reload_seconds,
+        "full_reload_peak_bytes": reload_peak,
+        "refreshes": refreshes,
+        "compaction_seconds": compact_seconds,
+        "compaction_peak_bytes": compact_peak,
+    }, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
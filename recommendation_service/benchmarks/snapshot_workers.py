@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import numpy as np
+from benchmarks.common import write_report
+from scoring import feature_fields, interest_weights, normalize_rows, weighted_cosine_scores, top_k
+from serving_index import CatalogueIndex
+from snapshot import export_snapshot, load_snapshot
+
+# Per-worker RSS and aggregate scoring throughput at 1/4/8 worker processes, with
+# each worker either attaching to a shared memory-mapped snapshot or holding its own
+# in-process copy of the catalogue. RssFile is page cache shared between workers;
+# RssAnon is memory private to each worker.
+# Run from recommendation_service/: python -m benchmarks.snapshot_workers
+
+corpus_size = int(os.getenv("BENCH_VIDEOS", "50000"))
+dim = int(os.getenv("BENCH_DIM", "768"))
+worker_counts = [int(n) for n in os.getenv("BENCH_WORKERS", "1,4,8").split(",")]
+duration_seconds = float(os.getenv("BENCH_SECONDS", "5"))
+
+def synthetic_index(size, rng):
+    matrices = {}
+    for feature in feature_fields:
+        mask = rng.random(size) > 0.3 if feature == 'tags' else np.ones(size, dtype=bool)
+        matrices[feature] = (normalize_rows(rng.standard_normal((size, dim), dtype=np.float32)), mask)
+    return CatalogueIndex([f'vid{i:08d}' for i in range(size)], rng.integers(60, 3600, size), matrices)
+
+def memory_status():
+    status = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('VmRSS', 'RssAnon', 'RssFile'):
+                status[name] = int(value.split()[0]) / 1024
+    return status
+
+def worker(mode, snapshot_root, start_at, results):
+    if mode == 'snapshot':
+        index = load_snapshot(snapshot_root)
+    else:
+        # An in-process copy, as CANDIDATE_SOURCE=memory would hold
+        mapped = load_snapshot(snapshot_root)
+        index = CatalogueIndex.from_sorted(np.array(mapped.ids, dtype=object), np.array(mapped.durations),
+                                           {f: (np.array(m), np.array(k)) for f, (m, k) in mapped.matrices.items()})
+    rng = np.random.default_rng(os.getpid())
+    while time.time() < start_at:
+        time.sleep(0.001)
+    queries = 0
+    stop_at = start_at + duration_seconds
+    while time.time() < stop_at:
+        start, stop = index.window(int(rng.integers(5, 50)) * 60, 150)
+        ids, matrices = index.candidates(start, stop)
+        query = rng.standard_normal(dim).astype(np.float32)
+        top_k(weighted_cosine_scores({f: query for f in interest_weights}, matrices, interest_weights), ids, 20)
+        queries += 1
+    results.put(dict(memory_status(), queries=queries))
+
+def run(mode, snapshot_root, workers):
+    results = multiprocessing.Queue()
+    start_at = time.time() + 2
+    processes = [multiprocessing.Process(target=worker, args=(mode, snapshot_root, start_at, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    stats = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {
+        "mode": mode,
+        "workers": workers,
+        "queries_per_second": sum(s['queries'] for s in stats) / duration_seconds,
+        "rss_mb_per_worker": float(np.mean([s['VmRSS'] for s in stats])),
+        "anon_mb_per_worker": float(np.mean([s['RssAnon'] for s in stats])),
+        "file_mb_per_worker": float(np.mean([s['RssFile'] for s in stats])),
+    }
+
+def main():
+    rng = np.random.default_rng(0)
+    snapshot_root = tempfile.mkdtemp(prefix='snapshot_bench_')
+    export_snapshot(synthetic_index(corpus_size, rng), snapshot_root)
+    results = [run(mode, snapshot_root, workers) for workers in worker_counts for mode in ('snapshot', 'private')]
+    write_report({"benchmark": "snapshot_workers", "videos": corpus_size, "dim": dim, "results": results}, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
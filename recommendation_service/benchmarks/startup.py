@@ -0,0 +1,55 @@
+import json
+import statistics
+import subprocess
+import sys
+import os
+
+# Guards the lazy-startup contract: importing the API must not load BERT,
+# the YouTube client or open Mongo connections.
+# Run from recommendation_service/: python -m benchmarks.startup
+
+budget_seconds = float(os.getenv("STARTUP_BUDGET_SECONDS", "1.0"))
+runs = int(os.getenv("STARTUP_RUNS", "5"))
+heavy_modules = ['torch', 'transformers', 'googleapiclient', 'sklearn']
+
+probe = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+import providers
+print(json.dumps({
+    "seconds": elapsed,
+    "heavy_modules": [m for m in %r if m in sys.modules],
+    "mongo_connected": providers.mongo_client is not None,
+}))
+""" % (heavy_modules,)
+
+def measure_once(service_dir):
+    output = subprocess.run([sys.executable, "-c", probe], cwd=service_dir, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main():
+    service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = [measure_once(service_dir) for _ in range(runs)]
+    timings = [r["seconds"] for r in results]
+    report = {
+        "benchmark": "startup",
+        "runs": runs,
+        "median_seconds": statistics.median(timings),
+        "max_seconds": max(timings),
+        "budget_seconds": budget_seconds,
+        "heavy_modules": results[0]["heavy_modules"],
+        "mongo_connected": results[0]["mongo_connected"],
+    }
+    print(json.dumps(report, indent=2))
+
+    if report["heavy_modules"] or report["mongo_connected"]:
+        print("startup imported heavy dependencies or connected to Mongo", file=sys.stderr)
+        sys.exit(1)
+    if report["median_seconds"] > budget_seconds:
+        print("startup exceeded budget", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import os
+import subprocess
+import time
+import numpy as np
+from bson import ObjectId
+from benchmarks.common import get_benchmark_database, insert_synthetic_videos, random_embedding, percentile, write_report
+from benchmarks.fakes import FakeYouTube, stub_embeddings
+from embedding_storage import encode_embedding
+import embedding_cache
+import recommendation_cache
+
+# End-to-end benchmark over a synthetic corpus, with no live Mongo, YouTube API or
+# BERT weights: mongomock stands in for the database (unless MONGO_URI is set),
+# stub_embeddings for the model and FakeYouTube for the API. For each corpus size it
+# times get_top_3, update_average_video_embedding, the rating and queue endpoints and
+# the ingest pipeline, and writes one JSON report so runs can be diffed across commits.
+# Install benchmarks/requirements.txt, then run from recommendation_service/:
+#   BENCH_OUTPUT=bench.json python -m benchmarks.suite
+
+corpus_sizes = [int(s) for s in os.getenv("BENCH_SIZES", "1000,5000,20000").split(",")]
+num_users = int(os.getenv("BENCH_USERS", "20"))
+seen_sizes = [int(s) for s in os.getenv("BENCH_SEEN_SIZES", "0,100,1000").split(",")]
+repeats = int(os.getenv("BENCH_REPEATS", "20"))
+ingest_queries = int(os.getenv("BENCH_INGEST_QUERIES", "8"))
+# Minutes, as get_top_3 takes them; synthetic videos run 60-3600 s
+durations = [5, 15, 30]
+feature_names = ['title', 'description', 'channel_title', 'category']
+interest_pool = ['machine learning', 'investing', 'cooking', 'history', 'basketball', 'chess', 'travel', 'music production']
+
+def timed(fn, count=repeats):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def summary(samples):
+    return {
+        "calls": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "mean_ms": float(np.mean(samples)) * 1000 if samples else 0.0,
+    }
+
+def synthetic_users(db, count, corpus_size, rng):
+    # Users spread over the seen-history sizes, with the legacy videos_seen array
+    # populated the way long-lived accounts have it
+    users = []
+    for index in range(count):
+        seen = seen_sizes[index % len(seen_sizes)]
+        interests = list(rng.choice(interest_pool, size=3, replace=False))
+        users.append({
+            '_id': ObjectId(),
+            'interests': interests,
+            'average_video': {feature: encode_embedding(random_embedding(rng)) for feature in feature_names},
+            'total_ratings': float(rng.integers(5, 50)),
+            'total_videos': int(rng.integers(5, 50)),
+            'videos_seen': [f'vid{i:08d}' for i in rng.choice(corpus_size, size=min(seen, corpus_size), replace=False)],
+        })
+    db['users'].insert_many(users)
+    return users
+
+def bench_top_3(db, users, rng):
+    import model
+    from indexes import user_profile_projection
+    results = {}
+    for retrieval in ['exact', 'ann'] if os.path.exists(os.getenv("ANN_INDEX_PATH", "ann_index.npz")) else ['exact']:
+        recommendation_cache.recommendation_cache = recommendation_cache.RecommendationCache()
+        def call():
+            user = db['users'].find_one({'_id': users[rng.integers(len(users))]['_id']}, user_profile_projection)
+            model.get_top_3(db['videos'], db['users'], user, int(rng.choice(durations)), retrieval)
+        results[retrieval] = summary(timed(call))
+        report = recommendation_cache.recommendation_cache.report()
+        results[retrieval].update({"cache_hit_rate": report['hit_rate'], "cold_p50_ms": report['cold_p50_ms'], "cached_p50_ms": report['cached_p50_ms']})
+    return results
+
+def bench_fold(rng):
+    from model import update_average_video_embedding
+    from scoring import feature_fields
+    average = {feature: encode_embedding(random_embedding(rng)) for feature in feature_names}
+    video = {feature_fields[feature]: encode_embedding(random_embedding(rng)) for feature in feature_names}
+    return summary(timed(lambda: update_average_video_embedding(average, 10.0, video, 7), repeats * 10))
+
+def bench_endpoints(db, users, corpus_size, rng):
+    from app import app
+    from rating_events import get_rating_aggregator
+    client = app.test_client()
+    def headers(**values):
+        return {name: str(value) for name, value in values.items()}
+    def random_user():
+        return str(users[rng.integers(len(users))]['_id'])
+    def random_video():
+        return f'vid{rng.integers(corpus_size):08d}'
+
+    results = {}
+    results['rate_video'] = summary(timed(lambda: client.post('/api/rate_video', headers=headers(userId=random_user(), videoId=random_video(), rating=rng.integers(5, 11)))))
+    results['rate_video_sync'] = summary(timed(lambda: client.post('/api/rate_video', headers=headers(userId=random_user(), videoId=random_video(), rating=rng.integers(5, 11), sync='true'))))
+    get_rating_aggregator().flush()
+
+    queued = []
+    def add():
+        user_id, video_id = random_user(), random_video()
+        client.post('/api/add_to_queue', headers=headers(userId=user_id, videoId=video_id))
+        queued.append((user_id, video_id))
+    results['add_to_queue'] = summary(timed(add))
+    results['get_queue'] = summary(timed(lambda: client.get('/api/get_queue', headers=headers(userId=random_user()))))
+    def remove():
+        user_id, video_id = queued.pop()
+        client.post('/api/remove_from_queue', headers=headers(userId=user_id, videoId=video_id))
+    results['remove_from_queue'] = summary(timed(remove, len(queued)))
+    return results
+
+def bench_ingest(db, corpus_size):
+    from ingest_pipeline import run_pipeline
+    youtube = FakeYouTube(results_per_query=min(500, corpus_size), catalogue_size=corpus_size)
+    searches = [{'search_string': f'benchmark topic {i}', 'num_results': 200} for i in range(ingest_queries)]
+    before = db['videos'].count_documents({})
+    start = time.perf_counter()
+    stats = run_pipeline(searches, youtube, db)
+    elapsed = time.perf_counter() - start
+    inserted = db['videos'].count_documents({}) - before
+    return {
+        "seconds": elapsed,
+        "videos_inserted": inserted,
+        "videos_per_second": inserted / elapsed if elapsed else 0.0,
+        "api_calls": dict(youtube.calls),
+        "pipeline": stats,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    embedding_cache.embedding_cache = embedding_cache.EmbeddingCache(None, embed_fn=stub_embeddings)
+    runs = []
+    for corpus_size in corpus_sizes:
+        rng = np.random.default_rng(corpus_size)
+        db = get_benchmark_database()
+        db.client.drop_database(db.name)
+        start = time.perf_counter()
+        insert_synthetic_videos(db, corpus_size)
+        users = synthetic_users(db, num_users, corpus_size, rng)
+        setup_seconds = time.perf_counter() - start
+        run = {
+            "corpus_size": corpus_size,
+            "users": num_users,
+            "setup_seconds": setup_seconds,
+            "get_top_3": bench_top_3(db, users, rng),
+            "update_average_video_embedding": bench_fold(rng),
+            "endpoints": bench_endpoints(db, users, corpus_size, rng),
+            "ingest": bench_ingest(db, corpus_size),
+        }
+        runs.append(run)
+
+    write_report({
+        "benchmark": "suite",
+        "commit": git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "repeats": repeats,
+        "seen_sizes": seen_sizes,
+        "runs": runs,
+    }, os.getenv("BENCH_OUTPUT"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+# A counter in catalogue_state that ingestion bumps whenever it adds videos, so
+# per-process caches derived from the catalogue know when they are stale.
+
+catalogue_version_ttl = float(os.getenv("CATALOGUE_VERSION_TTL", "5"))
+
+cached_version = None
+cached_at = 0.0
+cached_lock = threading.Lock()
+
+def bump_catalogue_version(db):
+    db['catalogue_state'].update_one({'_id': 'videos'}, {'$inc': {'version': 1}, '$set': {'updated_at': datetime.now()}}, upsert=True)
+
+def delete_videos(db, video_ids):
+    # Soft delete, so serving index refreshes see the change and tombstone the rows
+    result = db['videos'].update_many({'video_id': {'$in': list(video_ids)}}, {'$set': {'deleted': True, 'updated_at': datetime.now()}})
+    if result.modified_count:
+        bump_catalogue_version(db)
+    return result.modified_count
+
+def get_catalogue_version(db):
+    # Read at most once per TTL per process
+    global cached_version, cached_at
+    now = time.monotonic()
+    with cached_lock:
+        if cached_version is not None and now - cached_at < catalogue_version_ttl:
+            return cached_version
+    state = db['catalogue_state'].find_one({'_id': 'videos'}, {'version': 1}) or {}
+    with cached_lock:
+        cached_version = state.get('version', 0)
+        cached_at = now
+        return cached_version
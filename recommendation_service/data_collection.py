@@ -1,81 +1,36 @@
-from googleapiclient.discovery import build
-from dotenv import load_dotenv
+import logging
 import os
-import pymongo
-import random
-import torch
-from transformers import BertTokenizer, BertModel
 import re
+from datetime import datetime
+from embedding import make_embeddings
+from embedding_storage import encode_embedding
+from embedding_cache import get_embedding_cache
+from providers import get_collection, get_database, get_youtube
+from catalogue import bump_catalogue_version
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-api_key = os.getenv("YOUTUBE_API_KEY")
-
-youtube = build('youtube', 'v3', developerKey=api_key)
-
-#Set up a random seed for encoding
-random_seed = 42
-random.seed(random_seed)
- 
-# Set a random seed for PyTorch (for GPU as well)
-torch.manual_seed(random_seed)
-if torch.cuda.is_available():
-    torch.cuda.manual_seed_all(random_seed)
-
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-bert_model = BertModel.from_pretrained('bert-base-uncased')
-
-#Make MongoDB connection
-client = pymongo.MongoClient("mongodb://localhost:27017/")
-
-db = client['sparetime_database']
-video_collection = db['videos']
-
-def make_youtube_request(search_params):
+def search_request_params(search_params, max_results=None, page_token=None):
     request_params = {
         'part': 'snippet',
         'q': search_params['search_string'],
         'type': 'video',
-        'maxResults': search_params['num_results'],
+        'maxResults': max_results or search_params['num_results'],
         'order' : 'viewCount'
     }
 
     if 'channel_id' in search_params:
         request_params['channelId'] = search_params['channel_id']
+    if page_token:
+        request_params['pageToken'] = page_token
+    return request_params
 
-    request = youtube.search().list(**request_params)
+def make_youtube_request(search_params):
+    request = get_youtube().search().list(**search_request_params(search_params))
     response = request.execute()
     
     return response
 
-def make_embedding(text):
-    if(isinstance(text, str)):
-        text_input = [text]
-    elif(isinstance(text, list)):
-        text_input = [', '.join(text)]
-    else:
-        print(type(text), text)
-        raise ValueError('Invalid input')
-
-    # Tokenize and encode the example sentence
-    encoding = tokenizer.batch_encode_plus(
-        text_input,
-        padding=True,
-        truncation=True,
-        return_tensors='pt',
-        add_special_tokens=True
-    )
-
-    input_ids = encoding['input_ids']
-    attention_mask = encoding['attention_mask']
-
-    # Generate embeddings for the example sentence
-    with torch.no_grad():
-        outputs = bert_model(input_ids, attention_mask=attention_mask)
-        embedding = outputs.last_hidden_state.mean(dim=1)
-
-    return embedding
-
 def duration_to_seconds(duration):
     pattern = re.compile(r'PT(\d+M)?(\d+S)?')
     match = pattern.match(duration)
@@ -89,59 +44,112 @@ def duration_to_seconds(duration):
     total_seconds = minutes * 60 + seconds
     return total_seconds
 
-def store_metadata(metadata, search_tag):
+embedded_fields = {
+    'title_embedded': 'title',
+    'description_embedded': 'description',
+    'channel_title_embedded': 'channel_title',
+    'tags_embedded': 'tags',
+    'category_embedded': 'category',
+}
+
+ingest_flush_size = int(os.getenv("INGEST_FLUSH_SIZE", "64"))
+
+def collect_metadata(metadata, search_tag, skip_ids=()):
+    video_collection = get_collection('videos')
+    youtube = get_youtube()
+    videos = []
     for item in metadata['items']:
         video_id = item['id']['videoId']
         
+        if video_id in skip_ids:
+            continue
+
         existing_video = video_collection.find_one({'video_id': video_id})
         
         if existing_video:
-            print(f"Video with ID {video_id} already exists. Skipping insertion.")
+            logger.debug("Video with ID %s already exists. Skipping insertion.", video_id)
             continue
 
         vid_info_request = youtube.videos().list(part="snippet,contentDetails", id=video_id)
         more_vid_metadata = vid_info_request.execute()
         
         if 'items' not in more_vid_metadata or not more_vid_metadata['items']:
-            print(f"Could not retrieve additional metadata for video ID {video_id}. Skipping.")
+            logger.debug("Could not retrieve additional metadata for video ID %s. Skipping.", video_id)
             continue
         
-        more_details = more_vid_metadata['items'][0]
-        
-        tags = more_details['snippet'].get('tags', [])
+        videos.append(build_video_data(item, more_vid_metadata['items'][0], search_tag))
+
+    return videos
+
+def build_video_data(item, more_details, search_tag):
+    tags = more_details['snippet'].get('tags', [])
 
-        video_data = {
-            'video_id': video_id,
-            'title': item['snippet']['title'],
-            'title_embedded': make_embedding(item['snippet']['title']).tolist(),
-            'description': more_details['snippet'].get('description', item['snippet']['description']),
-            'description_embedded': make_embedding(more_details['snippet'].get('description', item['snippet']['description'])).tolist(),
-            'published_at': item['snippet']['publishedAt'],
-            'channel_title': item['snippet']['channelTitle'],
-            'channel_title_embedded': make_embedding(item['snippet']['channelTitle']).tolist(),
-            'channel_id': item['snippet']['channelId'],
-            'thumbnails': item['snippet']['thumbnails'],
-            'tags': tags,
-            'tags_embedded': [] if not tags else make_embedding(tags).tolist(),
-            'category': search_tag,
-            'category_embedded': make_embedding(search_tag).tolist(),
-            'duration': duration_to_seconds(more_details['contentDetails'].get('duration', 'Unknown')),
-            'definition': more_details['contentDetails'].get('definition', 'Unknown'),
-            'dimension': more_details['contentDetails'].get('dimension', 'Unknown'),
-            'licensed_content': more_details['contentDetails'].get('licensedContent', False),
-            'default_audio_language': more_details['snippet'].get('defaultAudioLanguage', 'Unknown')
-        }
+    video_data = {
+        'video_id': item['id']['videoId'],
+        'title': item['snippet']['title'],
+        'description': more_details['snippet'].get('description', item['snippet']['description']),
+        'published_at': item['snippet']['publishedAt'],
+        'channel_title': item['snippet']['channelTitle'],
+        'channel_id': item['snippet']['channelId'],
+        'thumbnails': item['snippet']['thumbnails'],
+        'tags': tags,
+        'category': search_tag,
+        'duration_in_seconds': duration_to_seconds(more_details['contentDetails'].get('duration', 'Unknown')),
+        'definition': more_details['contentDetails'].get('definition', 'Unknown'),
+        'dimension': more_details['contentDetails'].get('dimension', 'Unknown'),
+        'licensed_content': more_details['contentDetails'].get('licensedContent', False),
+        'default_audio_language': more_details['snippet'].get('defaultAudioLanguage', 'Unknown')
+    }
+    return video_data
+
+def embed_videos(videos, batch_size=None, num_threads=None):
+    # One batched embedding pass over every field of every video
+    texts = []
+    targets = []
+    for video in videos:
+        for embedded_field, text_field in embedded_fields.items():
+            if text_field == 'tags' and not video['tags']:
+                video[embedded_field] = []
+                continue
+            texts.append(video[text_field])
+            targets.append((video, embedded_field))
+
+    # Without overrides the cache's own embedder is used, so it can be swapped out
+    embed_fn = (lambda missing: make_embeddings(missing, batch_size, num_threads)) if batch_size or num_threads else None
+    cache = get_embedding_cache()
+    embeddings = cache.embed_many(texts, embed_fn)
+    for (video, embedded_field), embedding in zip(targets, embeddings):
+        video[embedded_field] = encode_embedding(embedding)
+    # Lets reembed_videos.py find videos embedded by an older model or pooling
+    for video in videos:
+        video['embedding_model_version'] = cache.model
+    return videos
+
+def insert_videos(videos, batch_size=None, num_threads=None):
+    if not videos:
+        return 0
+    embed_videos(videos, batch_size, num_threads)
+    now = datetime.now()
+    for video in videos:
+        video['updated_at'] = now
+    get_collection('videos').insert_many(videos)
+    bump_catalogue_version(get_database())
+    logger.info("inserted %d videos", len(videos))
+    return len(videos)
+
+def store_metadata(metadata, search_tag):
+    return insert_videos(collect_metadata(metadata, search_tag))
 
-        video_collection.insert_one(video_data)
-        print(f'inserted video: {video_id}')
+def make_entry(searches, batch_size=None, num_threads=None, run_id=None):
+    from ingest_pipeline import run_pipeline
 
-def make_entry(searches):
-    for search in searches:
-        try:
-            response = make_youtube_request(search)
-            store_metadata(response, search['search_string'])
-        except Exception as e:
-            print(f"Error processing search: {search['search_string']}. Error: {str(e)}")
+    embed = lambda videos: embed_videos(videos, batch_size, num_threads)
+    cache_before = get_embedding_cache().report()
+    stats = run_pipeline(searches, run_id=run_id, embed=embed)
+    stats['embedding_cache'] = get_embedding_cache().report(since=cache_before)
+    logger.info("Ingested %d videos in %.1fs (%.2f videos/sec), run_id %s", stats['videos_inserted'], stats['seconds'], stats['videos_per_second'], stats['run_id'])
+    logger.info("Embedding cache hit rate %.1f%%, %d forward passes saved", stats['embedding_cache']['hit_rate'] * 100, stats['embedding_cache']['forward_passes_saved'])
+    return stats
 
 initial_searches = [
     {'search_string': 'machine learning transformers', 'num_results': 5, 'chanel_id': 'UCYO_jab_esuFRV4b17AJtAw', 'chanel_name': '3blue1brown'}, 
@@ -0,0 +1,110 @@
+import logging
+import os
+import numpy as np
+from providers import embedding_backend, get_embedding_backend, get_embedding_model, model_name
+
+#Bump when the model or pooling changes so cached embeddings are recomputed.
+#Backends that reproduce the full-precision output within float rounding share its
+#version; int8 moves the vectors further, so its embeddings are versioned apart
+backend_versions = {'torch': 'mean-pool', 'onnx': 'mean-pool', 'torch-int8': 'mean-pool:int8'}
+model_version = model_name + ':' + backend_versions.get(embedding_backend, 'mean-pool:' + embedding_backend)
+
+# Accuracy tolerance per backend: the lowest cosine similarity to make_embedding (the
+# full-precision torch reference) allowed on any text. Checked by check_backend,
+# reembed_videos.py --check and benchmarks/embedding_backends.py
+backend_min_cosine = {'torch': 0.99999, 'onnx': 0.9999, 'torch-int8': 0.98}
+
+logger = logging.getLogger(__name__)
+
+embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+embedding_threads = int(os.getenv("EMBEDDING_THREADS", "0"))
+
+def embedding_text(text):
+    if(isinstance(text, str)):
+        return text
+    elif(isinstance(text, list)):
+        return ', '.join(text)
+    else:
+        logger.error("Cannot embed value of type %s", type(text).__name__)
+        raise ValueError('Invalid input')
+
+def make_embedding(text):
+    import torch
+
+    text_input = [embedding_text(text)]
+
+    tokenizer, bert_model = get_embedding_model()
+
+    # Tokenize and encode the example sentence
+    encoding = tokenizer.batch_encode_plus(
+        text_input,
+        padding=True,
+        truncation=True,
+        return_tensors='pt',
+        add_special_tokens=True
+    )
+
+    input_ids = encoding['input_ids']
+    attention_mask = encoding['attention_mask']
+
+    # Generate embeddings for the example sentence
+    with torch.no_grad():
+        outputs = bert_model(input_ids, attention_mask=attention_mask)
+        embedding = outputs.last_hidden_state.mean(dim=1)
+
+    return embedding
+
+def make_embeddings(texts, batch_size=None, num_threads=None, backend=None):
+    # Batched counterpart of make_embedding: returns one float32 row per text.
+    # Texts are sorted by token length and cut into batches so each forward pass
+    # pads only to the longest text in its bucket, and pooling ignores padding
+    # so every row matches what make_embedding gives for that text alone.
+    batch_size = batch_size or embedding_batch_size
+    num_threads = num_threads or embedding_threads
+    backend = backend or embedding_backend
+    if num_threads and backend != 'onnx':
+        import torch
+        torch.set_num_threads(num_threads)
+
+    tokenizer, model = get_embedding_backend(backend, num_threads)
+    text_input = [embedding_text(text) for text in texts]
+    if not text_input:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    token_ids = tokenizer(text_input, truncation=True, add_special_tokens=True)['input_ids']
+    order = sorted(range(len(text_input)), key=lambda i: len(token_ids[i]))
+
+    embeddings = None
+    for start in range(0, len(order), batch_size):
+        bucket = order[start:start + batch_size]
+        encoding = tokenizer.pad({'input_ids': [token_ids[i] for i in bucket]}, padding=True, return_tensors='np')
+        attention_mask = encoding['attention_mask']
+        hidden = last_hidden_state(model, encoding['input_ids'], attention_mask)
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / mask.sum(axis=1)
+
+        if embeddings is None:
+            embeddings = np.zeros((len(text_input), pooled.shape[1]), dtype=np.float32)
+        embeddings[bucket] = pooled
+
+    return embeddings
+
+def last_hidden_state(model, input_ids, attention_mask):
+    if hasattr(model, 'run'):
+        # onnxruntime session
+        feed = {'input_ids': input_ids.astype(np.int64), 'attention_mask': attention_mask.astype(np.int64)}
+        return model.run(['last_hidden_state'], feed)[0]
+    import torch
+    with torch.no_grad():
+        outputs = model(torch.from_numpy(input_ids), attention_mask=torch.from_numpy(attention_mask))
+    return outputs.last_hidden_state.numpy()
+
+def check_backend(texts, backend=None, batch_size=None):
+    # Lowest cosine similarity between the backend and the reference over texts,
+    # and whether it is within the backend's tolerance
+    backend = backend or embedding_backend
+    reference = np.stack([make_embedding(text).numpy().reshape(-1) for text in texts])
+    candidate = make_embeddings(texts, batch_size, backend=backend)
+    cosine = (reference * candidate).sum(axis=1) / (np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1))
+    min_cosine = float(cosine.min())
+    return min_cosine, min_cosine >= backend_min_cosine.get(backend, 1.0)
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+import numpy as np
+from cachetools import LRUCache
+from pymongo import UpdateOne
+from embedding import embedding_text, make_embeddings, model_version
+from embedding_storage import decode_embedding, encode_embedding
+from metrics import count_cache, timed_stage
+
+# Content-addressed cache in front of the embedding model, keyed by model version and
+# a hash of the normalized text. An in-process LRU bounded by bytes sits in front of a
+# persistent tier: the embedding_cache Mongo collection or a local directory.
+
+embedding_cache_bytes = int(os.getenv("EMBEDDING_CACHE_BYTES", str(256 * 1024 * 1024)))
+# 'mongo', 'disk' or 'none'
+embedding_cache_store = os.getenv("EMBEDDING_CACHE_STORE", "mongo")
+embedding_cache_dir = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+
+def normalize_text(text):
+    # Whitespace differences never change the tokens BERT sees
+    return ' '.join(embedding_text(text).split())
+
+def cache_key(text, model=model_version):
+    return hashlib.sha256((model + '\0' + normalize_text(text)).encode('utf-8')).hexdigest()
+
+class MongoEmbeddingStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_many(self, keys):
+        docs = self.collection.find({'_id': {'$in': list(keys)}}, {'embedding': 1})
+        return {doc['_id']: decode_embedding(doc['embedding']) for doc in docs}
+
+    def put_many(self, embeddings, model=model_version):
+        operations = [
+            UpdateOne({'_id': key}, {'$setOnInsert': {'model': model, 'embedding': encode_embedding(vector, 'float32')}}, upsert=True)
+            for key, vector in embeddings.items()
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+class DiskEmbeddingStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.npy')
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            path = self.path(key)
+            if os.path.exists(path):
+                found[key] = np.load(path)
+        return found
+
+    def put_many(self, embeddings, model=model_version):
+        for key, vector in embeddings.items():
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Per-writer name: threads or processes storing the same key never share a temp file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, np.asarray(vector, dtype=np.float32))
+            os.replace(tmp_path, path)
+
+class EmbeddingCache:
+    def __init__(self, store=None, max_bytes=embedding_cache_bytes, model=model_version, embed_fn=make_embeddings):
+        self.store = store
+        self.embed_fn = embed_fn
+        self.model = model
+        self.memory = LRUCache(maxsize=max_bytes, getsizeof=lambda vector: vector.nbytes)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'memory_hits': 0, 'store_hits': 0, 'duplicate_hits': 0, 'computed': 0}
+
+    def embed(self, text, embed_fn=None):
+        return self.embed_many([text], embed_fn)[0]
+
+    def embed_many(self, texts, embed_fn=None):
+        keys = [cache_key(text, self.model) for text in texts]
+        found = {}
+        with self.lock:
+            for key in set(keys):
+                vector = self.memory.get(key)
+                if vector is not None:
+                    found[key] = vector
+        memory_hits = len(found)
+
+        missing = [key for key in set(keys) if key not in found]
+        stored = self.store.get_many(missing) if self.store is not None and missing else {}
+        found.update(stored)
+
+        # Each distinct missing text is embedded once, however often it repeats
+        to_compute = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in to_compute:
+                to_compute[key] = text
+        computed = {}
+        if to_compute:
+            with timed_stage('inference'):
+                vectors = (embed_fn or self.embed_fn)(list(to_compute.values()))
+            computed = {key: np.asarray(vector, dtype=np.float32).reshape(-1) for key, vector in zip(to_compute, vectors)}
+            if self.store is not None:
+                self.store.put_many(computed, self.model)
+        found.update(computed)
+
+        with self.lock:
+            for key, vector in list(stored.items()) + list(computed.items()):
+                self.memory[key] = vector
+            self.stats['requests'] += len(keys)
+            self.stats['memory_hits'] += memory_hits
+            self.stats['store_hits'] += len(stored)
+            self.stats['computed'] += len(computed)
+            self.stats['duplicate_hits'] += len(keys) - memory_hits - len(stored) - len(computed)
+        count_cache('embeddings', 'memory_hit', memory_hits)
+        count_cache('embeddings', 'store_hit', len(stored))
+        count_cache('embeddings', 'miss', len(computed))
+
+        return np.stack([found[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def report(self, since=None):
+        # Counts since an earlier report() snapshot, or since startup
+        with self.lock:
+            stats = dict(self.stats)
+        if since is not None:
+            stats = {name: stats[name] - since.get(name, 0) for name in self.stats}
+        saved = stats['requests'] - stats['computed']
+        stats['forward_passes_saved'] = saved
+        stats['hit_rate'] = saved / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+embedding_cache = None
+embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    global embedding_cache
+    if embedding_cache is None:
+        with embedding_cache_lock:
+            if embedding_cache is None:
+                if embedding_cache_store == 'mongo':
+                    from providers import get_collection
+                    store = MongoEmbeddingStore(get_collection('embedding_cache'))
+                elif embedding_cache_store == 'disk':
+                    store = DiskEmbeddingStore(embedding_cache_dir)
+                else:
+                    store = None
+                embedding_cache = EmbeddingCache(store)
+    return embedding_cache
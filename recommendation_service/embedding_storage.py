@@ -0,0 +1,49 @@
+import os
+import numpy as np
+from bson.binary import Binary
+
+# Embeddings are stored either as the legacy nested [[...]] list of doubles or as a
+# little-endian Binary blob with its dtype and dimension alongside it. Readers accept
+# both so documents can be migrated in place (see migrate_embeddings.py).
+
+storage_dtypes = {
+    'float32': '<f4',
+    'float16': '<f2',
+}
+
+# 'list' keeps the legacy format; 'float32' or 'float16' write Binary blobs
+embedding_storage = os.getenv("EMBEDDING_STORAGE", "list")
+
+def encode_embedding(embedding, storage=None):
+    storage = storage or embedding_storage
+    vector = decode_embedding(embedding)
+    if vector is None:
+        return []
+    if storage == 'list':
+        return [vector.astype(np.float64).tolist()]
+    if storage not in storage_dtypes:
+        raise ValueError(f'Unknown embedding storage: {storage}')
+    data = np.ascontiguousarray(vector, dtype=storage_dtypes[storage]).tobytes()
+    return {'dtype': storage, 'dim': int(vector.size), 'data': Binary(data)}
+
+def decode_embedding(value):
+    # Returns a flat vector, or None for a missing/empty embedding
+    if value is None:
+        return None
+    if isinstance(value, dict) and 'data' in value:
+        return np.frombuffer(value['data'], dtype=storage_dtypes[value['dtype']], count=value['dim'])
+    if isinstance(value, np.ndarray):
+        vector = value.reshape(-1)
+    elif hasattr(value, 'numpy'):
+        vector = value.detach().cpu().numpy().reshape(-1)
+    else:
+        vector = np.asarray(value, dtype=np.float32).reshape(-1)
+    return vector if vector.size > 0 else None
+
+def is_stored_as(value, storage):
+    # Missing embeddings are stored as [] in every format
+    if decode_embedding(value) is None:
+        return True
+    if isinstance(value, dict) and 'data' in value:
+        return value['dtype'] == storage
+    return storage == 'list'
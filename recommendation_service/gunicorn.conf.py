@@ -0,0 +1,11 @@
+import os
+
+# Production serving: gunicorn -c gunicorn.conf.py app:app
+# With CANDIDATE_SOURCE=snapshot every worker maps the same exported catalogue.
+# Set PROMETHEUS_MULTIPROC_DIR to an empty directory so /metrics sums every worker.
+
+bind = os.getenv("BIND", "127.0.0.1:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+threads = int(os.getenv("WORKER_THREADS", "4"))
+# Each worker loads lazily after fork; preloading would fork a process that already holds BERT
+preload_app = False
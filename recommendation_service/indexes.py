@@ -0,0 +1,64 @@
+from pymongo import ASCENDING
+
+# Indexes the service's hot queries rely on, created idempotently on first connection
+
+index_specs = {
+    'videos': [
+        [('video_id', ASCENDING)],
+        [('duration_in_seconds', ASCENDING)],
+        [('updated_at', ASCENDING)],
+    ],
+    'seen_videos': [
+        ([('user_id', ASCENDING), ('video_id', ASCENDING)], {'unique': True}),
+    ],
+    'rating_events': [
+        [('claim', ASCENDING), ('user_id', ASCENDING)],
+    ],
+    'rating_queue': [
+        [('user_id', ASCENDING), ('timestamp', ASCENDING), ('_id', ASCENDING)],
+        [('user_id', ASCENDING), ('video_id', ASCENDING)],
+    ],
+}
+
+# Only the fields scoring needs, so titles, descriptions and thumbnails stay in Mongo
+candidate_projection = {
+    '_id': 0,
+    'video_id': 1,
+    'title_embedded': 1,
+    'description_embedded': 1,
+    'channel_title_embedded': 1,
+    'tags_embedded': 1,
+    'category_embedded': 1,
+}
+
+rating_video_projection = {
+    '_id': 0,
+    'video_id': 1,
+    'title_embedded': 1,
+    'description_embedded': 1,
+    'channel_title_embedded': 1,
+    'category_embedded': 1,
+}
+
+user_profile_projection = {
+    'interests': 1,
+    'interest_embedding': 1,
+    'average_video': 1,
+    'total_ratings': 1,
+    'total_videos': 1,
+    'videos_seen': 1,
+    'profile_version': 1,
+}
+
+video_info_projection = {'_id': 0, 'title': 1, 'description': 1, 'channel_title': 1}
+
+candidate_batch_size = 500
+
+# Soft-deleted videos (see catalogue.delete_videos) are never candidates
+live_videos = {'deleted': {'$ne': True}}
+
+def ensure_indexes(db):
+    for collection_name, specs in index_specs.items():
+        for spec in specs:
+            keys, options = spec if isinstance(spec, tuple) else (spec, {})
+            db[collection_name].create_index(keys, **options)
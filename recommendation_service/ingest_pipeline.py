@@ -0,0 +1,264 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pymongo import UpdateOne
+from catalogue import bump_catalogue_version
+from data_collection import search_request_params, build_video_data, embed_videos, ingest_flush_size
+
+logger = logging.getLogger(__name__)
+
+# Streaming ingestion for make_entry. Search pages are fetched concurrently and
+# paginated with nextPageToken; a details stage checks existence in bulk and fetches
+# video details 50 ids at a time; the calling thread embeds and upserts. Stages are
+# joined by bounded queues, so embedding overlaps with network I/O. A search is
+# checkpointed once all of its videos are written. Every call gets a fresh run_id (in
+# the returned stats); passing it back resumes that run, skipping completed searches.
+
+search_workers = int(os.getenv("INGEST_SEARCH_WORKERS", "4"))
+ingest_queue_size = int(os.getenv("INGEST_QUEUE_SIZE", "16"))
+retry_attempts = int(os.getenv("INGEST_RETRY_ATTEMPTS", "5"))
+retry_base_delay = float(os.getenv("INGEST_RETRY_DELAY", "0.5"))
+max_page_size = 50
+details_batch_size = 50
+
+done = object()
+
+def with_retry(call, attempts=None, base_delay=None):
+    attempts = attempts or retry_attempts
+    base_delay = retry_base_delay if base_delay is None else base_delay
+    for attempt in range(attempts):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = base_delay * (2 ** attempt) * (1 + random.random())
+            logger.warning("Retrying after error: %s (attempt %d/%d, waiting %.1fs)", e, attempt + 1, attempts, delay)
+            time.sleep(delay)
+
+def search_key(search):
+    return f"{search['search_string']}|{search.get('channel_id', '')}|{search['num_results']}"
+
+class SearchTracker:
+    # Counts outstanding videos per search so a search is checkpointed only once written
+    def __init__(self, checkpoint_collection, run_id):
+        self.checkpoint_collection = checkpoint_collection
+        self.run_id = run_id
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.pages_done = set()
+        self.failed = set()
+        self.completed = 0
+
+    def completed_keys(self):
+        checkpoint = self.checkpoint_collection.find_one({'_id': self.run_id}) or {}
+        return set(checkpoint.get('completed_searches', []))
+
+    def add(self, key, count):
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0) + count
+
+    def finish_pages(self, key):
+        with self.lock:
+            self.pages_done.add(key)
+        self.maybe_complete(key)
+
+    def fail(self, keys):
+        with self.lock:
+            self.failed.update(keys)
+
+    def resolve(self, keys):
+        for key in keys:
+            with self.lock:
+                self.pending[key] -= 1
+        for key in set(keys):
+            self.maybe_complete(key)
+
+    def maybe_complete(self, key):
+        with self.lock:
+            if key not in self.pages_done or key in self.failed or self.pending.get(key, 0) > 0:
+                return
+            self.pages_done.discard(key)
+            self.completed += 1
+        self.checkpoint_collection.update_one({'_id': self.run_id}, {'$addToSet': {'completed_searches': key}}, upsert=True)
+
+class IngestPipeline:
+    def __init__(self, searches, youtube, video_collection, checkpoint_collection, run_id=None,
+                 embed=embed_videos, flush_size=ingest_flush_size, workers=search_workers, queue_size=ingest_queue_size):
+        self.searches = searches
+        self.youtube = youtube
+        self.video_collection = video_collection
+        self.resume = run_id is not None
+        self.run_id = run_id or uuid.uuid4().hex
+        self.tracker = SearchTracker(checkpoint_collection, self.run_id)
+        self.embed = embed
+        self.flush_size = flush_size
+        self.workers = workers
+        self.items_queue = queue.Queue(maxsize=queue_size)
+        self.docs_queue = queue.Queue(maxsize=queue_size)
+        self.stats = {'pages': 0, 'videos_inserted': 0, 'videos_skipped': 0, 'searches_skipped': 0, 'errors': 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, stat, amount=1):
+        with self.stats_lock:
+            self.stats[stat] += amount
+
+    def run(self):
+        start = time.perf_counter()
+        completed = self.tracker.completed_keys() if self.resume else set()
+        searches = [search for search in self.searches if search_key(search) not in completed]
+        self.stats['searches_skipped'] = len(self.searches) - len(searches)
+
+        details_thread = threading.Thread(target=self.details_stage, name='ingest-details', daemon=True)
+        details_thread.start()
+        producer = threading.Thread(target=self.search_stage, args=(searches,), name='ingest-search', daemon=True)
+        producer.start()
+
+        self.write_stage()
+        producer.join()
+        details_thread.join()
+
+        elapsed = time.perf_counter() - start
+        self.stats['searches_completed'] = self.tracker.completed
+        self.stats['run_id'] = self.run_id
+        self.stats['seconds'] = elapsed
+        self.stats['videos_per_second'] = self.stats['videos_inserted'] / elapsed if elapsed > 0 else 0.0
+        return self.stats
+
+    def search_stage(self, searches):
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(self.fetch_search, searches))
+        finally:
+            self.items_queue.put(done)
+
+    def fetch_search(self, search):
+        key = search_key(search)
+        remaining = search['num_results']
+        page_token = None
+        try:
+            while remaining > 0:
+                params = search_request_params(search, min(remaining, max_page_size), page_token)
+                response = with_retry(lambda: self.youtube.search().list(**params).execute())
+                items = response.get('items', [])[:remaining]
+                self.count('pages')
+                self.tracker.add(key, len(items))
+                if items:
+                    self.items_queue.put((key, search['search_string'], items))
+                remaining -= len(items)
+                page_token = response.get('nextPageToken')
+                if not page_token or not items:
+                    break
+        except Exception as e:
+            logger.error("Error processing search: %s. Error: %s", search['search_string'], e)
+            self.count('errors')
+            self.tracker.fail([key])
+        finally:
+            self.tracker.finish_pages(key)
+
+    def details_stage(self):
+        seen_ids = set()
+        batch = []
+        try:
+            while True:
+                entry = self.items_queue.get()
+                if entry is done:
+                    break
+                key, search_tag, items = entry
+                for item in items:
+                    video_id = item['id']['videoId']
+                    if video_id in seen_ids:
+                        self.count('videos_skipped')
+                        self.tracker.resolve([key])
+                        continue
+                    seen_ids.add(video_id)
+                    batch.append((key, search_tag, item))
+                    if len(batch) == details_batch_size:
+                        self.fetch_details(batch)
+                        batch = []
+            if batch:
+                self.fetch_details(batch)
+        finally:
+            self.docs_queue.put(done)
+
+    def fetch_details(self, batch):
+        keys = [key for key, _, _ in batch]
+        try:
+            ids = [item['id']['videoId'] for _, _, item in batch]
+            existing = {doc['video_id'] for doc in self.video_collection.find({'video_id': {'$in': ids}}, {'_id': 0, 'video_id': 1})}
+            wanted = [entry for entry in batch if entry[2]['id']['videoId'] not in existing]
+            skipped = [key for key, _, item in batch if item['id']['videoId'] in existing]
+
+            details = {}
+            if wanted:
+                request_ids = ','.join(item['id']['videoId'] for _, _, item in wanted)
+                response = with_retry(lambda: self.youtube.videos().list(part="snippet,contentDetails", id=request_ids).execute())
+                details = {detail['id']: detail for detail in response.get('items', [])}
+
+            docs = []
+            for key, search_tag, item in wanted:
+                more_details = details.get(item['id']['videoId'])
+                if more_details is None:
+                    logger.debug("Could not retrieve additional metadata for video ID %s. Skipping.", item['id']['videoId'])
+                    skipped.append(key)
+                    continue
+                docs.append((key, build_video_data(item, more_details, search_tag)))
+
+            self.count('videos_skipped', len(skipped))
+            self.tracker.resolve(skipped)
+            if docs:
+                self.docs_queue.put(docs)
+        except Exception as e:
+            logger.error("Error fetching video details: %s", e)
+            self.count('errors')
+            self.tracker.fail(keys)
+            self.tracker.resolve(keys)
+
+    def write_stage(self):
+        pending = []
+        while True:
+            entry = self.docs_queue.get()
+            if entry is done:
+                break
+            pending.extend(entry)
+            if len(pending) >= self.flush_size:
+                self.write(pending)
+                pending = []
+        if pending:
+            self.write(pending)
+
+    def write(self, pending):
+        keys = [key for key, _ in pending]
+        try:
+            videos = self.embed([doc for _, doc in pending])
+            # Serving index refreshes pick videos up by updated_at
+            now = datetime.now()
+            for video in videos:
+                video['updated_at'] = now
+            operations = [UpdateOne({'video_id': video['video_id']}, {'$setOnInsert': video}, upsert=True) for video in videos]
+            result = with_retry(lambda: self.video_collection.bulk_write(operations, ordered=False))
+            self.count('videos_inserted', result.upserted_count)
+            if result.upserted_count:
+                bump_catalogue_version(self.video_collection.database)
+            logger.info("inserted %d videos", result.upserted_count)
+        except Exception as e:
+            logger.error("Error writing videos: %s", e)
+            self.count('errors')
+            self.tracker.fail(keys)
+        self.tracker.resolve(keys)
+
+def run_pipeline(searches, youtube=None, db=None, run_id=None, **options):
+    if youtube is None:
+        from providers import get_youtube
+        youtube = get_youtube()
+    if db is None:
+        from providers import get_database
+        db = get_database()
+    pipeline = IngestPipeline(searches, youtube, db['videos'], db['ingest_checkpoints'], run_id, **options)
+    return pipeline.run()
@@ -0,0 +1,87 @@
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+
+# Prometheus metrics for every endpoint, served on /metrics. Stages are labelled with
+# the endpoint of the request that ran them ('background' for the rating aggregator,
+# cache refills and other worker threads). Under gunicorn set PROMETHEUS_MULTIPROC_DIR
+# so /metrics aggregates all workers.
+
+logger = logging.getLogger(__name__)
+
+profile_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+profile_dir = os.getenv("PROFILE_DIR", "profiles")
+
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+size_buckets = (0, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+request_seconds = Histogram('recommendation_request_seconds', 'Request latency per endpoint', ['endpoint', 'status'], buckets=latency_buckets)
+stage_seconds = Histogram('recommendation_stage_seconds', 'Time spent in each stage of a request', ['endpoint', 'stage'], buckets=latency_buckets)
+mongo_command_seconds = Histogram('recommendation_mongo_command_seconds', 'Round trip of each Mongo command', ['endpoint', 'command'], buckets=latency_buckets)
+candidate_set_size = Histogram('recommendation_candidate_set_size', 'Videos scored per ranking', ['source'], buckets=size_buckets)
+cache_lookups = Counter('recommendation_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+top3_seconds = Histogram('recommendation_top3_seconds', 'get_top_3 latency, served from the recommendation cache or ranked cold', ['source'], buckets=latency_buckets)
+
+serving_refresh_seconds = Histogram('serving_index_refresh_seconds', 'Cost of one incremental serving index refresh', buckets=latency_buckets)
+serving_refresh_videos = Histogram('serving_index_refresh_videos', 'Videos pulled per serving index refresh', buckets=size_buckets)
+serving_refresh_lag = Histogram('serving_index_refresh_lag_seconds', 'Time from a video being written to it being servable', buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+serving_delta_rows = Gauge('serving_index_delta_rows', 'Videos in the serving index delta segment', multiprocess_mode='max')
+serving_tombstones = Gauge('serving_index_tombstones', 'Base rows of the serving index tombstoned since the last compaction', multiprocess_mode='max')
+
+current_endpoint = contextvars.ContextVar('current_endpoint', default='background')
+
+@contextmanager
+def timed_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.labels(current_endpoint.get(), stage).observe(time.perf_counter() - start)
+
+def count_cache(cache, result, amount=1):
+    if amount:
+        cache_lookups.labels(cache, result).inc(amount)
+
+class MongoCommandTimer(monitoring.CommandListener):
+    # Listener callbacks run on the thread that issued the command, so the endpoint
+    # context of the request is still set
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_seconds.labels(current_endpoint.get(), event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        mongo_command_seconds.labels(current_endpoint.get(), event.command_name).observe(event.duration_micros / 1e6)
+
+def start_profile():
+    if not profile_sample_rate or random.random() >= profile_sample_rate:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one profiler can be active at a time; another request already has it
+        return None
+    return profiler
+
+def finish_profile(profiler, name):
+    profiler.disable()
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, f"{name}-{time.time_ns()}.prof")
+    profiler.dump_stats(path)
+    logger.info("Wrote request profile %s", path)
+
+def render_metrics():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,110 @@
+import argparse
+from pymongo import UpdateOne
+from embedding_storage import encode_embedding, is_stored_as
+from providers import get_collection
+
+# Converts stored embeddings between formats, e.g. legacy lists -> float32 Binary.
+# Progress is checkpointed per collection in the 'migrations' collection, so an
+# interrupted run resumes after the last converted _id. User writes are guarded by
+# profile_version like rating folds, so a fold landing mid-migration is never lost.
+# Usage: python migrate_embeddings.py --storage float32 [--batch-size 500] [--restart]
+
+video_fields = ['title_embedded', 'description_embedded', 'channel_title_embedded', 'tags_embedded', 'category_embedded']
+average_video_fields = ['title', 'description', 'channel_title', 'category']
+video_projection = {field: 1 for field in video_fields}
+user_projection = {'average_video': 1, 'interest_embedding': 1, 'profile_version': 1}
+guarded_attempts = 5
+
+def video_updates(doc, storage):
+    updates = {}
+    for field in video_fields:
+        if field in doc and not is_stored_as(doc[field], storage):
+            updates[field] = encode_embedding(doc[field], storage)
+    return updates
+
+def user_updates(doc, storage):
+    updates = {}
+    average_video = doc.get('average_video') or {}
+    for field in average_video_fields:
+        if field in average_video and not is_stored_as(average_video[field], storage):
+            updates['average_video.' + field] = encode_embedding(average_video[field], storage)
+    interest_embedding = doc.get('interest_embedding') or {}
+    if 'embedding' in interest_embedding and not is_stored_as(interest_embedding['embedding'], storage):
+        updates['interest_embedding.embedding'] = encode_embedding(interest_embedding['embedding'], storage)
+    return updates
+
+def guarded_update(collection, doc, make_updates, projection, storage, attempts=guarded_attempts):
+    # Writes only if profile_version is unchanged since the read, re-reading on a miss.
+    # Returns 1 if converted, 0 if nothing to do, None if it kept conflicting
+    for _ in range(attempts):
+        updates = make_updates(doc, storage)
+        if not updates:
+            return 0
+        result = collection.update_one(
+            {'_id': doc['_id'], 'profile_version': doc.get('profile_version')},
+            {'$set': updates, '$inc': {'profile_version': 1}}
+        )
+        if result.matched_count:
+            return 1
+        doc = collection.find_one({'_id': doc['_id']}, projection)
+        if doc is None:
+            return 0
+    return None
+
+def migrate_collection(name, make_updates, projection, storage, batch_size, restart=False, guarded=False):
+    collection = get_collection(name)
+    migrations = get_collection('migrations')
+    checkpoint_id = f'embedding_storage:{storage}:{name}'
+
+    if restart:
+        migrations.delete_one({'_id': checkpoint_id})
+    checkpoint = migrations.find_one({'_id': checkpoint_id}) or {}
+    query = {'_id': {'$gt': checkpoint['last_id']}} if 'last_id' in checkpoint else {}
+
+    converted = 0
+    conflicted = 0
+    scanned = 0
+    operations = []
+    last_id = None
+    cursor = collection.find(query, projection).sort('_id', 1).batch_size(batch_size)
+    for doc in cursor:
+        scanned += 1
+        last_id = doc['_id']
+        if guarded:
+            result = guarded_update(collection, doc, make_updates, projection, storage)
+            converted += result or 0
+            conflicted += result is None
+        else:
+            updates = make_updates(doc, storage)
+            if updates:
+                operations.append(UpdateOne({'_id': doc['_id']}, {'$set': updates}))
+        if scanned % batch_size == 0:
+            converted += flush(collection, migrations, checkpoint_id, operations, last_id)
+            operations = []
+    if last_id is not None:
+        converted += flush(collection, migrations, checkpoint_id, operations, last_id)
+
+    print(f"{name}: scanned {scanned}, converted {converted} documents to {storage}")
+    if conflicted:
+        # Both formats stay readable; rerun with --restart to convert these later
+        print(f"{name}: skipped {conflicted} documents that kept changing during the migration")
+    return converted
+
+def flush(collection, migrations, checkpoint_id, operations, last_id):
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    migrations.update_one({'_id': checkpoint_id}, {'$set': {'last_id': last_id}}, upsert=True)
+    return len(operations)
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert stored embeddings to a new storage format')
+    parser.add_argument('--storage', choices=['list', 'float32', 'float16'], default='float32')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--restart', action='store_true', help='ignore saved checkpoints and rescan from the start')
+    args = parser.parse_args()
+
+    migrate_collection('videos', video_updates, video_projection, args.storage, args.batch_size, args.restart)
+    migrate_collection('users', user_updates, user_projection, args.storage, args.batch_size, args.restart, guarded=True)
+
+if __name__ == '__main__':
+    main()
@@ -1,144 +1,237 @@
-from sklearn.metrics.pairwise import cosine_similarity
+import logging
+import os
+import time
 import numpy as np
-import pymongo
-import random
-import torch
-from transformers import BertTokenizer, BertModel
-from data_collection import make_embedding
+import hashlib
+import threading
+from cachetools import LRUCache
+from embedding import model_version
+from embedding_cache import get_embedding_cache
+from embedding_storage import decode_embedding, encode_embedding
+from scoring import interest_weights, ratings_weights, stack_candidates, weighted_cosine_scores, weighted_cosine_score_matrix, top_k, top_k_rows
+from indexes import candidate_projection, candidate_batch_size, live_videos
+from ann_index import get_ann_index, ann_candidate_ids
+from serving_index import get_serving_index, candidate_source, rerank_candidates
+from seen_videos import get_seen_video_ids, mark_seen
+from recommendation_cache import get_recommendation_cache, recommendation_fingerprint
+from metrics import timed_stage, count_cache, candidate_set_size
 import math
 
+logger = logging.getLogger(__name__)
+
+interest_embedding_cache = LRUCache(maxsize=4096)
+interest_embedding_lock = threading.Lock()
+
+# 'exact' scores every candidate in the duration window; 'ann' goes through ann_index first
+default_retrieval = os.getenv("RECOMMENDATION_RETRIEVAL", "exact")
+duration_tolerance = 150
+
+feature_map = {'title': 'title_embedded',
+'description': 'description_embedded',
+'channel_title': 'channel_title_embedded',
+'category': 'category_embedded'}
+
 def update_average_video_embedding(avg_vid_embedding, total_ratings, new_video, new_rating):
-    new_rating = float(new_rating) - 4.5
-    total_ratings += new_rating
+    return fold_ratings(avg_vid_embedding, total_ratings, [new_video], [new_rating])
+
+def fold_ratings(avg_vid_embedding, total_ratings, new_videos, new_ratings):
+    # Applies ratings in order, as repeated single updates would, with all
+    # features of the average video updated together as one matrix
+    features = [feature for feature in avg_vid_embedding if feature != '_id']
+    ratings = np.asarray(new_ratings, dtype=np.float64) - 4.5
+    if not features:
+        return [avg_vid_embedding, total_ratings + float(ratings.sum())]
 
-    feature_map = {'title': 'title_embedded',
-    'description': 'description_embedded',
-    'channel_title': 'channel_title_embedded',
-    'category': 'category_embedded'}
+    new_embs = np.stack([
+        np.stack([decode_embedding(video[feature_map[feature]]) for feature in features])
+        for video in new_videos
+    ]).astype(np.float64)
 
     #Make this check that the avg_vid_embedding is empty
-    is_empty = False
-    for feature in avg_vid_embedding:
-        if feature != '_id' and len(avg_vid_embedding[feature]) == 0:
-            is_empty = True
-
-    if is_empty:
-        for feature in avg_vid_embedding:
-            if feature != '_id':
-                avg_vid_embedding[feature] = (np.array(new_video[feature_map[feature]]) * new_rating).tolist()
+    is_empty = any(decode_embedding(avg_vid_embedding[feature]) is None for feature in features)
+    avg = None if is_empty else np.stack([decode_embedding(avg_vid_embedding[feature]) for feature in features]).astype(np.float64)
+
+    for rating, new_emb in zip(ratings, new_embs):
+        total_ratings += rating
+        if avg is None:
+            avg = new_emb * rating
+        else:
+            avg = (avg * total_ratings + new_emb * rating) / (total_ratings + 1)
+
+    for feature, row in zip(features, avg):
+        avg_vid_embedding[feature] = encode_embedding(row)
+    return [avg_vid_embedding, float(total_ratings)]
+
+def interest_embedding_key(interests):
+    return hashlib.sha256((model_version + '|' + ', '.join(interests)).encode('utf-8')).hexdigest()
+
+def get_interest_embedding(user, users_collection=None):
+    key = interest_embedding_key(user["interests"])
+    with interest_embedding_lock:
+        embedding = interest_embedding_cache.get(key)
+    if embedding is not None:
+        count_cache('interest_embedding', 'memory_hit')
+        return embedding
+
+    #Reuse the copy stored on the profile unless the interests or model changed since
+    stored = user.get("interest_embedding") or {}
+    if stored.get("key") == key:
+        count_cache('interest_embedding', 'profile_hit')
+        with timed_stage('embedding_decode'):
+            embedding = decode_embedding(stored["embedding"]).astype(np.float32)
     else:
-        for feature in avg_vid_embedding:
-            if feature != '_id':
-                old_emb = np.array(avg_vid_embedding[feature])
-                new_emb = np.array(new_video[feature_map[feature]]) * new_rating
-                new_avg = (old_emb * total_ratings + new_emb) / (total_ratings + 1)
-                avg_vid_embedding[feature] = new_avg.tolist()
+        count_cache('interest_embedding', 'miss')
+        embedding = get_embedding_cache().embed(user["interests"])
+        if users_collection is not None:
+            with timed_stage('write_back'):
+                users_collection.update_one({"_id": user["_id"]}, {"$set": {"interest_embedding": {"key": key, "embedding": encode_embedding(embedding)}}})
 
-    return [avg_vid_embedding, total_ratings]
+    with interest_embedding_lock:
+        interest_embedding_cache[key] = embedding
+    return embedding
 
-def interest_video_similarity(user, videos, num_vids):
+def interest_video_similarity(user, videos, num_vids, candidates=None, interest_embedding=None, allowed=None):
     if user["interests"] == []:
         return []
     
-    interest_embedding = make_embedding(user["interests"])
-    similarities = []
-    video_weights = {
-        "title": 0.32,
-        "description" : 0.32,
-        "channel_title": 0.12,
-        "tags" : 0.12,
-        "category" : 0.12,
-     }
-
-    for video in videos:
-        video_data = {
-            "video id": video.get('video_id', []),
-            "title": video.get('title_embedded', []),
-            "description" : video.get('description_embedded', []),
-            "channel_title": video.get('channel_title_embedded', []),
-            "tags" : video.get('tags_embedded', []),
-            "category" : video.get('category_embedded', [])
-            }
-
-        weighted_sum_similarity = 0
-        total_weight = 0 
-
-        for feature in video_weights:
-            if len(video_data[feature]) > 0:
-                video_feature_emb = torch.tensor(video_data[feature]).reshape(1, -1)
-                similarity = cosine_similarity(interest_embedding, video_feature_emb)
-                weighted_sum_similarity += video_weights[feature] * similarity[0][0]
-                total_weight += video_weights[feature]
-
-        if total_weight > 0:
-            normalized_similarity = weighted_sum_similarity / total_weight
-            similarities.append((normalized_similarity, video_data["video id"]))
-    
-    similarities.sort(reverse = True)
-    return similarities[:num_vids]
+    ids, matrices = candidates if candidates is not None else stack_candidates(videos)
+    if interest_embedding is None:
+        interest_embedding = get_interest_embedding(user)
+    queries = {feature: interest_embedding for feature in interest_weights}
+    with timed_stage('scoring'):
+        scores = weighted_cosine_scores(queries, matrices, interest_weights)
+    with timed_stage('top_k'):
+        return top_k(scores, ids, num_vids, allowed)
      
 
-def ratings_video_similarity(user, videos, num_vids):
+def ratings_video_similarity(user, videos, num_vids, candidates=None, allowed=None):
     avg_vid = user["average_video"]
 
     if avg_vid == {}:
         return []
     
-    similarities = []
-    video_weights = {
-        "title": 0.35,
-        "description" : 0.35,
-        "channel_title": 0.15,
-        "category" : 0.15,
-     }
-
-    for video in videos:
-        video_data = {
-            "video id": video.get('video_id', []),
-            "title": video.get('title_embedded', []),
-            "description" : video.get('description_embedded', []),
-            "channel_title": video.get('channel_title_embedded', []),
-            "category" : video.get('category_embedded', [])
-            }
-
-        weighted_sum_similarity = 0
-        total_weight = 0 
-
-        for feature in video_weights:
-            if len(video_data[feature]) > 0:
-                video_feature_emb = torch.tensor(video_data[feature]).reshape(1, -1)
-                avg_video_feature_emb = torch.tensor(avg_vid[feature]).reshape(1, -1)
-                similarity = cosine_similarity(avg_video_feature_emb, video_feature_emb)
-                weighted_sum_similarity += video_weights[feature] * similarity[0][0]
-                total_weight += video_weights[feature]
-
-        if total_weight > 0:
-            normalized_similarity = weighted_sum_similarity / total_weight
-            similarities.append((normalized_similarity, video_data["video id"]))
-    
-    similarities.sort(reverse = True)
-    return similarities[:num_vids]
+    ids, matrices = candidates if candidates is not None else stack_candidates(videos)
+    with timed_stage('scoring'):
+        scores = weighted_cosine_scores(avg_vid, matrices, ratings_weights)
+    with timed_stage('top_k'):
+        return top_k(scores, ids, num_vids, allowed)
 
-def get_top_3(video_collection, users_collection, user, duration):
-    tolerance = 150
+def merge_top_k(ranked, more, k):
+    return sorted(ranked + more, key=lambda x: x[0], reverse=True)[:k]
+
+def candidate_chunks(cursor, chunk_size=candidate_batch_size):
+    chunk = []
+    for video in cursor:
+        chunk.append(video)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def unseen_mask(ids, seen):
+    return np.fromiter((video_id not in seen for video_id in ids), dtype=bool, count=len(ids))
+
+def rank_candidates(user, cursor, num_vids, interest_embedding=None, include_ratings=True, seen=frozenset()):
+    # Scores the cursor one bounded chunk at a time, keeping only the running top-k
+    interest_list = []
+    ratings_list = []
+    scored = 0
+    chunks = candidate_chunks(cursor)
+    while True:
+        with timed_stage('mongo_fetch'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        with timed_stage('embedding_decode'):
+            candidates = stack_candidates(chunk)
+        scored += len(chunk)
+        allowed = unseen_mask(candidates[0], seen)
+        interest_list = merge_top_k(interest_list, interest_video_similarity(user, chunk, num_vids, candidates, interest_embedding, allowed), num_vids)
+        if include_ratings:
+            ratings_list = merge_top_k(ratings_list, ratings_video_similarity(user, chunk, num_vids, candidates, allowed), num_vids)
+    candidate_set_size.labels('mongo').observe(scored)
+    return interest_list, ratings_list
+
+def shortlist_rows(score_rows, allowed, size=rerank_candidates):
+    # Union of the best rows under each approximate score vector
+    rows = [top_k_rows(scores, size, allowed) for scores in score_rows]
+    return np.unique(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.intp)
+
+def rank_window(serving_index, user, target_duration, tolerance, num_vids, interest_embedding=None, include_ratings=True, candidate_ids=None, seen=frozenset(), video_collection=None, alive=None):
+    # alive optionally masks out tombstoned rows of the index
+    start, stop = serving_index.window(target_duration, tolerance)
+    ids, matrices = serving_index.candidates(start, stop)
+    allowed = unseen_mask(ids, seen)
+    if alive is not None:
+        allowed &= alive[start:stop]
+    if candidate_ids is not None:
+        allowed &= np.isin(ids, candidate_ids)
+    candidate_set_size.labels(candidate_source).observe(int(allowed.sum()))
+
+    if serving_index.quantized:
+        # Shortlist on the quantized matrices, then rank the shortlist on exact float32 rows
+        score_rows = []
+        with timed_stage('scoring'):
+            if user["interests"] and interest_embedding is not None:
+                score_rows.append(weighted_cosine_scores({feature: interest_embedding for feature in interest_weights}, matrices, interest_weights))
+            if include_ratings and user["average_video"] != {}:
+                score_rows.append(weighted_cosine_scores(user["average_video"], matrices, ratings_weights))
+        rows = shortlist_rows(score_rows, allowed)
+        with timed_stage('rerank_fetch'):
+            ids, matrices = serving_index.exact_candidates(start + rows, video_collection)
+        allowed = np.ones(len(ids), dtype=bool)
+
+    interest_list = interest_video_similarity(user, None, num_vids, (ids, matrices), interest_embedding, allowed)
+    ratings_list = ratings_video_similarity(user, None, num_vids, (ids, matrices), allowed) if include_ratings else []
+    return interest_list, ratings_list
+
+def rank_videos(video_collection, users_collection, user, duration, retrieval=default_retrieval, num_vids=20, seen=None):
+    # Full hybrid ranking of unseen videos for one duration, best first; seen is read
+    # from seen_videos unless the caller already has it
+    tolerance = duration_tolerance
     target_duration = duration*60
+    first_time = user['total_videos'] == 0
+
+    interest_embedding = get_interest_embedding(user, users_collection) if user["interests"] else None
+    if seen is None:
+        with timed_stage('mongo_fetch'):
+            seen = get_seen_video_ids(users_collection, user)
 
-    videos = list(video_collection.find({
-        "video_id": {"$nin": user["videos_seen"]},
-        "duration_in_seconds": {
-            "$gte": target_duration - tolerance, 
-            "$lte": target_duration + tolerance
+    #Approximate mode: narrow the candidates with the ANN index, then rerank them exactly
+    index = get_ann_index() if retrieval == 'ann' else None
+    candidate_ids = None
+    if index is not None:
+        duration_range = (target_duration - tolerance, target_duration + tolerance)
+        with timed_stage('ann_search'):
+            candidate_ids = ann_candidate_ids(index, user, interest_embedding, duration_range, seen)
+
+    if candidate_source != 'mongo':
+        interest_list, ratings_list = [], []
+        for segment, alive in get_serving_index(video_collection).segments():
+            more_interest, more_ratings = rank_window(segment, user, target_duration, tolerance, num_vids, interest_embedding, not first_time, candidate_ids, seen, video_collection, alive)
+            interest_list = merge_top_k(interest_list, more_interest, num_vids)
+            ratings_list = merge_top_k(ratings_list, more_ratings, num_vids)
+    else:
+        query = {
+            "duration_in_seconds": {
+                "$gte": target_duration - tolerance, 
+                "$lte": target_duration + tolerance
+            },
+            **live_videos,
         }
-    }))
+        if candidate_ids is not None:
+            query["video_id"] = {"$in": candidate_ids}
+        cursor = video_collection.find(query, candidate_projection).batch_size(candidate_batch_size)
+        interest_list, ratings_list = rank_candidates(user, cursor, num_vids, interest_embedding, not first_time, seen)
+
+    return combine_rankings(user, interest_list, ratings_list)
+
+def combine_rankings(user, interest_list, ratings_list):
     if user['total_videos'] == 0:
-        print('here')
-        top_3 = [video_id for similarity, video_id in interest_video_similarity(user, videos, 3)]
-        users_collection.update_one({"_id": user["_id"]}, {"$set": {"videos_seen": top_3}})
-        return top_3
+        logger.debug("Ranking first-time user %s by interests only", user['_id'])
+        return [video_id for similarity, video_id in interest_list]
     
-    interest_list = interest_video_similarity(user, videos, 20)
-    ratings_list = ratings_video_similarity(user, videos, 20)
-
     total_rated = user["total_videos"]
     bias_factor = 1 - math.exp(-0.80 * total_rated)
 
@@ -151,9 +244,185 @@ def get_top_3(video_collection, users_collection, user, duration):
         combined_list.append((combined_sim, video_id))
 
     combined_list.sort(reverse=True, key=lambda x: x[0])
-    top_3 = [video_id for _, video_id in combined_list[:3]]
-    
-    user["videos_seen"].extend(top_3)
-    users_collection.update_one({"_id": user["_id"]}, {"$set": {"videos_seen": user["videos_seen"]}})
+    return [video_id for _, video_id in combined_list]
+
+def get_top_3(video_collection, users_collection, user, duration, retrieval=default_retrieval):
+    cache = get_recommendation_cache()
+    key = (user["_id"], duration, retrieval)
+    fingerprint = recommendation_fingerprint(users_collection.database, user)
+    start = time.perf_counter()
+
+    # Cached lists may hold videos served since they were ranked, e.g. through an
+    # overlapping duration window
+    with timed_stage('mongo_fetch'):
+        seen = get_seen_video_ids(users_collection, user)
+    top_3 = cache.pop(key, fingerprint, 3, seen)
+    cached = top_3 is not None
+    if not cached:
+        ranked = rank_videos(video_collection, users_collection, user, duration, retrieval, seen=seen)
+        top_3 = ranked[:3]
+        cache.fill(key, fingerprint, ranked[3:])
 
+    with timed_stage('write_back'):
+        mark_seen(users_collection, user["_id"], top_3)
+    cache.record(cached, time.perf_counter() - start)
+
+    # Refill in the background before the list runs dry; the ranking reads seen_videos,
+    # so the ids just handed out are excluded
+    if cache.needs_refill(key):
+        cache.refill(key, fingerprint, lambda: rank_videos(video_collection, users_collection, user, duration, retrieval))
     return top_3
+
+def rank_videos_batch(video_collection, users_collection, users, durations, num_vids=20, seen=None):
+    # rank_videos for every (user, duration) pair. With the serving index each user's
+    # queries are scored against the span covering all requested windows at once, then
+    # cut per window with a mask; from Mongo each window is streamed once and scored
+    # for every user together
+    target_durations = [duration*60 for duration in durations]
+
+    interest_queries = []
+    for user in users:
+        embedding = get_interest_embedding(user, users_collection) if user["interests"] else None
+        interest_queries.append({feature: embedding for feature in interest_weights} if embedding is not None else {})
+    if seen is None:
+        with timed_stage('mongo_fetch'):
+            seen = [get_seen_video_ids(users_collection, user) for user in users]
+
+    lists = {}
+    if candidate_source == 'mongo':
+        for duration, target_duration in zip(durations, target_durations):
+            window_lists = rank_mongo_window_batch(video_collection, users, target_duration, interest_queries, seen, num_vids)
+            for row, ranked in enumerate(window_lists):
+                lists[(row, duration)] = ranked
+        return {(users[row]["_id"], duration): combine_rankings(users[row], *lists[(row, duration)])
+                for row in range(len(users)) for duration in durations}
+
+    for index, alive in get_serving_index(video_collection).segments():
+        segment_lists = rank_segment_batch(index, alive, users, durations, target_durations, interest_queries, seen, video_collection, num_vids)
+        for pair, (interest_list, ratings_list) in segment_lists.items():
+            merged = lists.get(pair, ([], []))
+            lists[pair] = (merge_top_k(merged[0], interest_list, num_vids), merge_top_k(merged[1], ratings_list, num_vids))
+
+    return {(users[row]["_id"], duration): combine_rankings(users[row], *lists.get((row, duration), ([], [])))
+            for row in range(len(users)) for duration in durations}
+
+def rank_mongo_window_batch(video_collection, users, target_duration, interest_queries, seen, num_vids):
+    # rank_candidates for several users: one streamed query, one scoring pass per chunk
+    query = {
+        "duration_in_seconds": {"$gte": target_duration - duration_tolerance, "$lte": target_duration + duration_tolerance},
+        **live_videos,
+    }
+    cursor = video_collection.find(query, candidate_projection).batch_size(candidate_batch_size)
+    lists = [([], []) for _ in users]
+    scored = 0
+    chunks = candidate_chunks(cursor)
+    while True:
+        with timed_stage('mongo_fetch'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        with timed_stage('embedding_decode'):
+            ids, matrices = stack_candidates(chunk)
+        scored += len(chunk)
+        with timed_stage('scoring'):
+            interest_scores = weighted_cosine_score_matrix(interest_queries, matrices, interest_weights)
+            ratings_scores = weighted_cosine_score_matrix([user["average_video"] for user in users], matrices, ratings_weights)
+        for row, user in enumerate(users):
+            allowed = unseen_mask(ids, seen[row])
+            with timed_stage('top_k'):
+                interest_list = top_k(interest_scores[row], ids, num_vids, allowed)
+                ratings_list = top_k(ratings_scores[row], ids, num_vids, allowed) if user['total_videos'] != 0 else []
+            lists[row] = (merge_top_k(lists[row][0], interest_list, num_vids), merge_top_k(lists[row][1], ratings_list, num_vids))
+    candidate_set_size.labels('mongo').observe(scored)
+    return lists
+
+def rank_segment_batch(index, alive, users, durations, target_durations, interest_queries, seen, video_collection, num_vids):
+    spans = index.windows(target_durations, duration_tolerance)
+    start, stop = min(span[0] for span in spans), max(span[1] for span in spans)
+    if stop <= start:
+        return {}
+    ids, matrices = index.candidates(start, stop)
+    candidate_set_size.labels('batch').observe(stop - start)
+
+    in_window = []
+    for span_start, span_stop in spans:
+        mask = np.zeros(len(ids), dtype=bool)
+        mask[span_start - start:span_stop - start] = True
+        if alive is not None:
+            mask &= alive[start:stop]
+        in_window.append(mask)
+
+    with timed_stage('scoring'):
+        interest_scores = weighted_cosine_score_matrix(interest_queries, matrices, interest_weights)
+        ratings_scores = weighted_cosine_score_matrix([user["average_video"] for user in users], matrices, ratings_weights)
+
+    allowed = {}
+    for row, user in enumerate(users):
+        unseen = unseen_mask(ids, seen[row])
+        for duration, mask in zip(durations, in_window):
+            allowed[(row, duration)] = unseen & mask
+
+    if index.quantized:
+        # Shortlist every pair on the quantized scores, then rescore the union of the
+        # shortlists exactly in one more pass
+        score_rows = []
+        for (row, duration), pair_allowed in allowed.items():
+            score_rows.append(shortlist_rows([interest_scores[row]] + ([ratings_scores[row]] if users[row]['total_videos'] != 0 else []), pair_allowed))
+        rows = np.unique(np.concatenate(score_rows))
+        with timed_stage('rerank_fetch'):
+            ids, matrices = index.exact_candidates(start + rows, video_collection)
+        with timed_stage('scoring'):
+            interest_scores = weighted_cosine_score_matrix(interest_queries, matrices, interest_weights)
+            ratings_scores = weighted_cosine_score_matrix([user["average_video"] for user in users], matrices, ratings_weights)
+        allowed = {pair: pair_allowed[rows] for pair, pair_allowed in allowed.items()}
+
+    lists = {}
+    for (row, duration), pair_allowed in allowed.items():
+        with timed_stage('top_k'):
+            interest_list = top_k(interest_scores[row], ids, num_vids, pair_allowed)
+            ratings_list = top_k(ratings_scores[row], ids, num_vids, pair_allowed) if users[row]['total_videos'] != 0 else []
+        lists[(row, duration)] = (interest_list, ratings_list)
+    return lists
+
+def get_top_3_batch(video_collection, users_collection, users, durations, retrieval=default_retrieval):
+    # get_top_3 for several users and/or durations. Cached lists are used as usual;
+    # all misses are ranked together by rank_videos_batch. A video is handed to a
+    # user at most once per batch, even when their duration windows overlap.
+    if retrieval != 'exact':
+        return {(user["_id"], duration): get_top_3(video_collection, users_collection, user, duration, retrieval)
+                for user in users for duration in durations}
+
+    cache = get_recommendation_cache()
+    fingerprints = {user["_id"]: recommendation_fingerprint(users_collection.database, user) for user in users}
+    # Keyed in request order; every entry is filled below
+    results = {(user["_id"], duration): None for user in users for duration in durations}
+    handed_out = {user["_id"]: set() for user in users}
+    # Seen before this batch or handed out earlier in it
+    with timed_stage('mongo_fetch'):
+        seen = {user["_id"]: get_seen_video_ids(users_collection, user) for user in users}
+    misses = []
+    for user in users:
+        for duration in durations:
+            top_3 = cache.pop((user["_id"], duration, retrieval), fingerprints[user["_id"]], 3, seen[user["_id"]])
+            if top_3 is None:
+                misses.append((user, duration))
+            else:
+                results[(user["_id"], duration)] = top_3
+                handed_out[user["_id"]].update(top_3)
+                seen[user["_id"]].update(top_3)
+
+    if misses:
+        miss_users = list({user["_id"]: user for user, _ in misses}.values())
+        miss_durations = sorted({duration for _, duration in misses})
+        ranked = rank_videos_batch(video_collection, users_collection, miss_users, miss_durations, seen=[seen[user["_id"]] for user in miss_users])
+        for user, duration in misses:
+            ranked_ids = [video_id for video_id in ranked[(user["_id"], duration)] if video_id not in seen[user["_id"]]]
+            results[(user["_id"], duration)] = ranked_ids[:3]
+            handed_out[user["_id"]].update(ranked_ids[:3])
+            seen[user["_id"]].update(ranked_ids[:3])
+            cache.fill((user["_id"], duration, retrieval), fingerprints[user["_id"]], ranked_ids[3:])
+
+    with timed_stage('write_back'):
+        for user in users:
+            mark_seen(users_collection, user["_id"], list(handed_out[user["_id"]]))
+    return results
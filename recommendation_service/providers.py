@@ -0,0 +1,129 @@
+import os
+import threading
+
+# Heavy clients are created on first use so importing the service stays cheap.
+# Each getter builds its client at most once per process.
+
+mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+database_name = 'sparetime_database'
+ensure_indexes_on_connect = os.getenv("ENSURE_INDEXES", "1") == "1"
+model_name = 'bert-base-uncased'
+# 'torch', 'torch-int8' (dynamically quantized Linear layers) or 'onnx'. onnxruntime is
+# an optional install for the onnx backend only: pip install onnxruntime
+embedding_backend = os.getenv("EMBEDDING_BACKEND", "torch")
+embedding_onnx_path = os.getenv("EMBEDDING_ONNX_PATH", os.path.join("models", model_name + ".onnx"))
+random_seed = 42
+
+provider_lock = threading.RLock()
+mongo_client = None
+youtube_client = None
+embedding_model = None
+embedding_backends = {}
+
+def get_mongo_client():
+    global mongo_client
+    if mongo_client is None:
+        with provider_lock:
+            if mongo_client is None:
+                import pymongo
+                from metrics import MongoCommandTimer
+                client = pymongo.MongoClient(mongo_uri, event_listeners=[MongoCommandTimer()])
+                if ensure_indexes_on_connect:
+                    from indexes import ensure_indexes
+                    ensure_indexes(client[database_name])
+                mongo_client = client
+    return mongo_client
+
+def get_database():
+    return get_mongo_client()[database_name]
+
+def get_collection(name):
+    return get_database()[name]
+
+def get_youtube():
+    global youtube_client
+    if youtube_client is None:
+        with provider_lock:
+            if youtube_client is None:
+                from dotenv import load_dotenv
+                from googleapiclient.discovery import build
+                load_dotenv()
+                youtube_client = build('youtube', 'v3', developerKey=os.getenv("YOUTUBE_API_KEY"))
+    return youtube_client
+
+def get_embedding_model():
+    global embedding_model
+    if embedding_model is None:
+        with provider_lock:
+            if embedding_model is None:
+                import random
+                import torch
+                from transformers import BertTokenizer, BertModel
+
+                #Set up a random seed for encoding (for GPU as well)
+                random.seed(random_seed)
+                torch.manual_seed(random_seed)
+                if torch.cuda.is_available():
+                    torch.cuda.manual_seed_all(random_seed)
+
+                tokenizer = BertTokenizer.from_pretrained(model_name)
+                bert_model = BertModel.from_pretrained(model_name)
+                bert_model.eval()
+                embedding_model = (tokenizer, bert_model)
+    return embedding_model
+
+def get_embedding_backend(backend=None, num_threads=0):
+    # (tokenizer, model) for the requested backend. model is a BertModel for the torch
+    # backends and an onnxruntime session for 'onnx'; num_threads only applies when
+    # the session is first created
+    backend = backend or embedding_backend
+    if backend not in embedding_backends:
+        with provider_lock:
+            if backend not in embedding_backends:
+                if backend == 'torch':
+                    tokenizer, model = get_embedding_model()
+                elif backend == 'torch-int8':
+                    import torch
+                    tokenizer, bert_model = get_embedding_model()
+                    model = torch.quantization.quantize_dynamic(bert_model, {torch.nn.Linear}, dtype=torch.qint8)
+                elif backend == 'onnx':
+                    # Once exported, the graph is served without loading the torch model
+                    from transformers import BertTokenizer
+                    tokenizer = BertTokenizer.from_pretrained(model_name)
+                    model = load_onnx_session(num_threads)
+                else:
+                    raise ValueError(f'Unknown embedding backend: {backend}')
+                embedding_backends[backend] = (tokenizer, model)
+    return embedding_backends[backend]
+
+def load_onnx_session(num_threads=0):
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ValueError("EMBEDDING_BACKEND=onnx needs onnxruntime (pip install onnxruntime)")
+    if not os.path.exists(embedding_onnx_path):
+        export_onnx(get_embedding_model()[1], embedding_onnx_path)
+    options = onnxruntime.SessionOptions()
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return onnxruntime.InferenceSession(embedding_onnx_path, options, providers=['CPUExecutionProvider'])
+
+def export_onnx(bert_model, path):
+    import torch
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    sample = torch.ones((1, 8), dtype=torch.long)
+    sequence_axes = {0: 'batch', 1: 'sequence'}
+    # Written under a temporary name so concurrent workers never load a partial graph
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.onnx.export(
+        bert_model, (sample, sample), tmp_path,
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['last_hidden_state', 'pooler_output'],
+        dynamic_axes={'input_ids': sequence_axes, 'attention_mask': sequence_axes, 'last_hidden_state': sequence_axes},
+        opset_version=14,
+    )
+    os.replace(tmp_path, path)
+
+def warm_up():
+    # Optional: pay the model load before the first request instead of during it
+    get_embedding_backend()
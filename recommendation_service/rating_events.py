@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from indexes import rating_video_projection
+from model import fold_ratings
+from recommendation_cache import get_recommendation_cache
+from metrics import timed_stage
+
+# /api/rate_video appends a small event to rating_events and returns. A background
+# RatingAggregator folds pending events into each user's average_video in batches.
+# Profile writes are guarded by profile_version, so concurrent aggregators (one per
+# worker) never lose an update: a conflicting user's events are released and retried.
+
+rating_flush_interval = float(os.getenv("RATING_FLUSH_INTERVAL", "2.0"))
+rating_claim_timeout = timedelta(seconds=float(os.getenv("RATING_CLAIM_TIMEOUT", "60")))
+rating_sync_attempts = int(os.getenv("RATING_SYNC_ATTEMPTS", "5"))
+rating_sync_delay = float(os.getenv("RATING_SYNC_DELAY", "0.05"))
+# Flush tokens kept on each profile; a flush checks for its own token right after writing
+applied_flush_history = 32
+
+logger = logging.getLogger(__name__)
+
+def record_rating(db, user_id, video_id, rating):
+    event = {'user_id': user_id, 'video_id': video_id, 'rating': float(rating), 'timestamp': datetime.now()}
+    db['rating_events'].insert_one(event)
+    return event
+
+class RatingAggregator:
+    def __init__(self, db, flush_interval=rating_flush_interval):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'flushes': 0, 'events_applied': 0, 'conflicts': 0, 'last_flush_seconds': 0.0, 'last_staleness_seconds': 0.0}
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='rating-aggregator', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Error flushing rating events: %s", e)
+
+    def flush(self):
+        # Applies every pending event now and returns how many were folded into profiles;
+        # safe to call from request threads
+        with self.flush_lock:
+            start = time.perf_counter()
+            token = uuid.uuid4().hex
+            events = self.claim(token)
+            applied = self.apply(events, token) if events else 0
+            self.stats['flushes'] += 1
+            self.stats['last_flush_seconds'] = time.perf_counter() - start
+            return applied
+
+    def flush_event(self, event_id, attempts=rating_sync_attempts, delay=rating_sync_delay):
+        # Flushes until the event is gone, i.e. applied by this or another worker.
+        # False if it is still pending after every attempt (conflicts kept releasing
+        # it, or another worker holds the claim)
+        for attempt in range(attempts):
+            self.flush()
+            if self.db['rating_events'].find_one({'_id': event_id}, {'_id': 1}) is None:
+                return True
+            time.sleep(delay * 2 ** attempt)
+        return False
+
+    def claim(self, token):
+        events_collection = self.db['rating_events']
+        now = datetime.now()
+        events_collection.update_many(
+            {'$or': [{'claim': {'$exists': False}}, {'claimed_at': {'$lt': now - rating_claim_timeout}}]},
+            {'$set': {'claim': token, 'claimed_at': now}}
+        )
+        return list(events_collection.find({'claim': token}).sort('_id', 1))
+
+    def apply(self, events, token):
+        by_user = defaultdict(list)
+        for event in events:
+            by_user[event['user_id']].append(event)
+
+        with timed_stage('mongo_fetch'):
+            users = {user['_id']: user for user in self.db['users'].find(
+                {'_id': {'$in': list(by_user)}},
+                {'average_video': 1, 'total_ratings': 1, 'total_videos': 1, 'profile_version': 1}
+            )}
+            videos = {video['video_id']: video for video in self.db['videos'].find(
+                {'video_id': {'$in': list({event['video_id'] for event in events})}},
+                rating_video_projection
+            )}
+
+        operations = []
+        folded = {}
+        for user_id, user_events in by_user.items():
+            user = users.get(user_id)
+            user_events = [event for event in user_events if event['video_id'] in videos]
+            if user is None or not user_events:
+                continue
+            folded[user_id] = len(user_events)
+            with timed_stage('fold_ratings'):
+                new_avg, new_total = fold_ratings(
+                    user['average_video'], user['total_ratings'],
+                    [videos[event['video_id']] for event in user_events],
+                    [event['rating'] for event in user_events]
+                )
+            operations.append(UpdateOne(
+                {'_id': user_id, 'profile_version': user.get('profile_version')},
+                {'$set': {'average_video': new_avg, 'total_ratings': new_total,
+                          'total_videos': user['total_videos'] + len(user_events)},
+                 '$inc': {'profile_version': 1},
+                 '$push': {'applied_flushes': {'$each': [token], '$slice': -applied_flush_history}}}
+            ))
+        if operations:
+            with timed_stage('write_back'):
+                self.db['users'].bulk_write(operations, ordered=False)
+
+        # Users whose profile moved since we read it keep their events for the next flush.
+        # The token stays in applied_flushes when another flush writes the profile next
+        applied = {user['_id'] for user in self.db['users'].find({'_id': {'$in': list(by_user)}, 'applied_flushes': token}, {'_id': 1})}
+        conflicted = [user_id for user_id in by_user if user_id in users and user_id not in applied and any(e['video_id'] in videos for e in by_user[user_id])]
+        if conflicted:
+            self.db['rating_events'].update_many({'claim': token, 'user_id': {'$in': conflicted}}, {'$unset': {'claim': '', 'claimed_at': ''}})
+        # Applied events and events for missing users or videos are done
+        self.db['rating_events'].delete_many({'claim': token, 'user_id': {'$nin': conflicted}})
+
+        # Other workers notice the new profile_version; drop this process's lists right away
+        cache = get_recommendation_cache()
+        for user_id in applied:
+            cache.invalidate_user(user_id)
+
+        applied_events = sum(folded[user_id] for user_id in applied)
+        self.stats['events_applied'] += applied_events
+        self.stats['conflicts'] += len(conflicted)
+        self.stats['last_staleness_seconds'] = (datetime.now() - min(event['timestamp'] for event in events)).total_seconds()
+        return applied_events
+
+aggregator = None
+aggregator_lock = threading.Lock()
+
+def get_rating_aggregator(db=None):
+    # One background aggregator per process, started with the app or on first use
+    global aggregator
+    if aggregator is None:
+        with aggregator_lock:
+            if aggregator is None:
+                if db is None:
+                    from providers import get_database
+                    db = get_database()
+                aggregator = RatingAggregator(db).start()
+    return aggregator
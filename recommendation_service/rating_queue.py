@@ -0,0 +1,65 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+
+# Videos a user has queued to rate later. Each entry stores a reference to the video
+# plus the title shown in the queue, instead of a full copy of the video document with
+# its embeddings. Entries written before that keep the copy under 'video' and are still
+# read until migrate_legacy_queue has slimmed them down.
+
+queue_projection = {'video_id': 1, 'title': 1, 'timestamp': 1, 'video.video_id': 1, 'video.title': 1}
+
+def queue_entry(user_id, video):
+    return {'user_id': user_id, 'video_id': video['video_id'], 'title': video['title'], 'timestamp': datetime.now()}
+
+def add_to_queue(queue, user_id, video):
+    queue.insert_one(queue_entry(user_id, video))
+
+def encode_cursor(entry):
+    return f"{entry['timestamp'].isoformat()}_{entry['_id']}"
+
+def decode_cursor(cursor):
+    timestamp, _, entry_id = cursor.rpartition('_')
+    return datetime.fromisoformat(timestamp), ObjectId(entry_id)
+
+def get_queue_page(queue, user_id, limit=None, cursor=None):
+    # Oldest first, ordered by (timestamp, _id) so entries added in the same millisecond
+    # still page deterministically. Returns the entries and the cursor for the next page.
+    query = {'user_id': user_id}
+    if cursor:
+        timestamp, entry_id = decode_cursor(cursor)
+        query['$or'] = [{'timestamp': {'$gt': timestamp}}, {'timestamp': timestamp, '_id': {'$gt': entry_id}}]
+    found = queue.find(query, queue_projection).sort([('timestamp', 1), ('_id', 1)])
+    if limit:
+        # One extra entry tells us whether another page exists
+        found = found.limit(limit + 1)
+    entries = list(found)
+    next_cursor = None
+    if limit and len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1])
+    videos = [{'video_id': entry.get('video_id') or entry['video']['video_id'], 'title': entry.get('title') or entry['video']['title']} for entry in entries]
+    return videos, next_cursor
+
+def remove_from_queue(queue, user_id, video_id):
+    result = queue.delete_one({'user_id': user_id, '$or': [{'video_id': video_id}, {'video.video_id': video_id}]})
+    return result.deleted_count > 0
+
+def migrate_legacy_queue(queue, batch_size=1000):
+    migrated = 0
+    operations = []
+    for entry in queue.find({'video': {'$exists': True}}, {'video.video_id': 1, 'video.title': 1}):
+        operations.append(UpdateOne(
+            {'_id': entry['_id']},
+            {'$set': {'video_id': entry['video']['video_id'], 'title': entry['video'].get('title', '')}, '$unset': {'video': ''}}
+        ))
+        if len(operations) == batch_size:
+            migrated += queue.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        migrated += queue.bulk_write(operations, ordered=False).modified_count
+    return migrated
+
+if __name__ == '__main__':
+    from providers import get_collection
+    print(f"Slimmed {migrate_legacy_queue(get_collection('rating_queue'))} rating_queue entries")
@@ -0,0 +1,123 @@
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from cachetools import LRUCache
+from catalogue import get_catalogue_version
+from metrics import count_cache, top3_seconds
+
+# Short ranked lists of upcoming recommendations per (user, duration, retrieval mode).
+# /api/top3 pops from the list and a background worker tops it up. Each list is tagged
+# with a fingerprint of what the ranking depended on: the user's profile_version (bumped
+# when ratings change average_video), their interests, and the catalogue version (bumped
+# on ingest). A request whose fingerprint differs is treated as a miss.
+
+recommendation_cache_users = int(os.getenv("RECOMMENDATION_CACHE_ENTRIES", "100000"))
+recommendation_refill_at = int(os.getenv("RECOMMENDATION_REFILL_AT", "6"))
+latency_samples = 10000
+
+logger = logging.getLogger(__name__)
+
+def recommendation_fingerprint(db, user):
+    return (user.get('profile_version'), user.get('total_videos'), tuple(user.get('interests') or ()), get_catalogue_version(db))
+
+class RecommendationCache:
+    def __init__(self, max_entries=recommendation_cache_users, refill_at=recommendation_refill_at):
+        self.entries = LRUCache(maxsize=max_entries)
+        self.refill_at = refill_at
+        self.lock = threading.Lock()
+        self.refilling = set()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='recommendation-refill')
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'refills': 0}
+        self.latencies = {'cached': deque(maxlen=latency_samples), 'cold': deque(maxlen=latency_samples)}
+
+    def pop(self, key, fingerprint, count, exclude=()):
+        # Ids in exclude (already handed out elsewhere) are dropped from the list
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != fingerprint:
+                del self.entries[key]
+                self.stats['invalidations'] += 1
+                entry = None
+            taken = []
+            if entry is not None:
+                while entry[1] and len(taken) < count:
+                    video_id = entry[1].popleft()
+                    if video_id not in exclude:
+                        taken.append(video_id)
+            if len(taken) < count:
+                if entry is not None:
+                    entry[1].extendleft(reversed(taken))
+                self.stats['misses'] += 1
+                count_cache('recommendations', 'miss')
+                return None
+            self.stats['hits'] += 1
+            count_cache('recommendations', 'hit')
+            return taken
+
+    def fill(self, key, fingerprint, ranked_ids):
+        with self.lock:
+            self.entries[key] = (fingerprint, deque(ranked_ids))
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == user_id]:
+                del self.entries[key]
+                self.stats['invalidations'] += 1
+
+    def needs_refill(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return key not in self.refilling and (entry is None or len(entry[1]) < self.refill_at)
+
+    def refill(self, key, fingerprint, rank):
+        with self.lock:
+            if key in self.refilling:
+                return
+            self.refilling.add(key)
+        self.executor.submit(self.run_refill, key, fingerprint, rank)
+
+    def run_refill(self, key, fingerprint, rank):
+        try:
+            ranked = rank()
+            with self.lock:
+                # Drop the result if the list was invalidated or refilled meanwhile
+                entry = self.entries.get(key)
+                if entry is None or entry[0] == fingerprint:
+                    self.entries[key] = (fingerprint, deque(ranked))
+                    self.stats['refills'] += 1
+        except Exception as e:
+            logger.exception("Error refilling recommendations: %s", e)
+        finally:
+            with self.lock:
+                self.refilling.discard(key)
+
+    def record(self, cached, seconds):
+        top3_seconds.labels('cached' if cached else 'cold').observe(seconds)
+        with self.lock:
+            self.latencies['cached' if cached else 'cold'].append(seconds)
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+            latencies = {name: list(samples) for name, samples in self.latencies.items()}
+            stats['entries'] = len(self.entries)
+        requests = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / requests if requests else 0.0
+        for name, samples in latencies.items():
+            stats[f'{name}_p50_ms'] = float(np.percentile(samples, 50)) * 1000 if samples else None
+            stats[f'{name}_p99_ms'] = float(np.percentile(samples, 99)) * 1000 if samples else None
+        return stats
+
+recommendation_cache = None
+recommendation_cache_lock = threading.Lock()
+
+def get_recommendation_cache():
+    global recommendation_cache
+    if recommendation_cache is None:
+        with recommendation_cache_lock:
+            if recommendation_cache is None:
+                recommendation_cache = RecommendationCache()
+    return recommendation_cache
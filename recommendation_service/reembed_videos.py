@@ -0,0 +1,134 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+from pymongo import UpdateOne
+import embedding
+import embedding_cache
+from catalogue import bump_catalogue_version
+from data_collection import embed_videos, embedded_fields
+from embedding import check_backend, model_version
+from indexes import live_videos
+from providers import get_collection, get_database
+
+# Re-embeds every video whose embedding_model_version differs from the configured
+# model (embedding.model_version), e.g. after changing the model, pooling or
+# EMBEDDING_BACKEND. The parent streams pending _ids in chunks to a pool of worker
+# processes, each embedding its chunk in one batched pass and writing it back with a
+# single bulk_write that stamps embedding_model_version and updated_at, so live serving
+# indexes pick the new vectors up. Finished documents drop out of the pending query,
+# so an interrupted run resumes where it stopped.
+# Usage: python reembed_videos.py [--workers 4] [--chunk-size 256] [--check 64] [--cache-store] [--stamp-unversioned]
+
+text_projection = {'video_id': 1, **{field: 1 for field in embedded_fields.values()}}
+
+def pending_query(version=model_version):
+    return {'embedding_model_version': {'$ne': version}, **live_videos}
+
+def pending_chunks(collection, chunk_size, version=model_version):
+    chunk = []
+    for doc in collection.find(pending_query(version), {'_id': 1}).sort('_id', 1).batch_size(chunk_size * 4):
+        chunk.append(doc['_id'])
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def init_worker(threads=0, store_cache=False, embed_fn=None):
+    # Workers split the cores between them instead of each starting one thread per core
+    if threads:
+        embedding.embedding_threads = threads
+    # Titles and descriptions are nearly all unique, so by default the job keeps its
+    # vectors out of the persistent embedding cache; the in-memory tier still dedups
+    # channel and category texts within a worker
+    if embed_fn is not None or not store_cache:
+        embedding_cache.embedding_cache = embedding_cache.EmbeddingCache(None, embed_fn=embed_fn or embedding.make_embeddings)
+
+def reembed_chunk(ids, version=model_version):
+    collection = get_collection('videos')
+    videos = list(collection.find({'_id': {'$in': ids}, **pending_query(version)}, text_projection))
+    if not videos:
+        return 0
+    embed_videos(videos)
+    now = datetime.now()
+    operations = []
+    for video in videos:
+        updates = {field: video[field] for field in embedded_fields}
+        updates['embedding_model_version'] = video['embedding_model_version']
+        updates['updated_at'] = now
+        operations.append(UpdateOne({'_id': video['_id']}, {'$set': updates}))
+    collection.bulk_write(operations, ordered=False)
+    bump_catalogue_version(get_database())
+    return len(operations)
+
+def reembed(workers=1, chunk_size=256, store_cache=False, embed_fn=None, progress_interval=10.0):
+    collection = get_collection('videos')
+    pending = collection.count_documents(pending_query())
+    chunks = pending_chunks(collection, chunk_size)
+    start = time.perf_counter()
+    last_report = start
+    written = 0
+
+    if workers <= 1:
+        init_worker(store_cache=store_cache, embed_fn=embed_fn)
+        pool = None
+        results = map(reembed_chunk, chunks)
+    else:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # spawn, since a forked child must not reuse the parent's Mongo connections
+        pool = multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker, initargs=(threads, store_cache, embed_fn))
+        results = pool.imap_unordered(reembed_chunk, chunks)
+    try:
+        for count in results:
+            written += count
+            now = time.perf_counter()
+            if now - last_report >= progress_interval:
+                print(f"re-embedded {written}/{pending} videos ({written / (now - start):.1f} videos/sec)")
+                last_report = now
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    seconds = time.perf_counter() - start
+    return {'pending': pending, 'reembedded': written, 'seconds': seconds, 'videos_per_second': written / seconds if seconds else 0.0}
+
+def stamp_unversioned(collection, version=model_version):
+    # Videos ingested before versions were recorded were embedded by the full-precision
+    # mean-pooled model; records that without re-embedding them
+    result = collection.update_many({'embedding_model_version': {'$exists': False}}, {'$set': {'embedding_model_version': version}})
+    return result.modified_count
+
+def check_sample(collection, size):
+    texts = []
+    for video in collection.aggregate([{'$match': live_videos}, {'$sample': {'size': size}}, {'$project': {'title': 1, 'description': 1}}]):
+        texts.extend([video['title'], video['description']])
+    return check_backend(texts) if texts else (1.0, True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-embed videos whose embeddings came from another model version')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=256, help='videos per bulk write')
+    parser.add_argument('--check', type=int, default=0, metavar='N', help='first compare the backend with the reference model on N sampled videos')
+    parser.add_argument('--cache-store', action='store_true', help='also write the new embeddings to the persistent embedding cache')
+    parser.add_argument('--stamp-unversioned', action='store_true', help=f'mark videos without a version as {embedding.model_name}:mean-pool instead of re-embedding them')
+    args = parser.parse_args()
+
+    collection = get_collection('videos')
+    if args.stamp_unversioned:
+        print(f"Stamped {stamp_unversioned(collection, embedding.model_name + ':mean-pool')} unversioned videos")
+    if args.check:
+        min_cosine, ok = check_sample(collection, args.check)
+        print(f"{embedding.embedding_backend}: lowest cosine similarity to the reference {min_cosine:.5f}")
+        if not ok:
+            print(f"below the {embedding.backend_min_cosine[embedding.embedding_backend]} tolerance, not re-embedding", file=sys.stderr)
+            sys.exit(1)
+
+    stats = reembed(args.workers, args.chunk_size, args.cache_store)
+    print(f"Re-embedded {stats['reembedded']} of {stats['pending']} videos to {model_version} in {stats['seconds']:.1f}s ({stats['videos_per_second']:.1f} videos/sec)")
+
+if __name__ == '__main__':
+    main()
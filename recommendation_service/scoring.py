@@ -0,0 +1,103 @@
+import numpy as np
+from embedding_storage import decode_embedding
+from quantization import QuantizedMatrix
+
+interest_weights = {
+    "title": 0.32,
+    "description": 0.32,
+    "channel_title": 0.12,
+    "tags": 0.12,
+    "category": 0.12,
+}
+
+ratings_weights = {
+    "title": 0.35,
+    "description": 0.35,
+    "channel_title": 0.15,
+    "category": 0.15,
+}
+
+feature_fields = {
+    "title": "title_embedded",
+    "description": "description_embedded",
+    "channel_title": "channel_title_embedded",
+    "tags": "tags_embedded",
+    "category": "category_embedded",
+}
+
+def to_vector(embedding):
+    vector = decode_embedding(embedding)
+    if vector is None:
+        return None
+    return vector.astype(np.float32, copy=False)
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def stack_candidates(videos, features=feature_fields):
+    ids = []
+    rows = {feature: [] for feature in features}
+    for video in videos:
+        ids.append(video.get('video_id'))
+        for feature in features:
+            rows[feature].append(to_vector(video.get(feature_fields[feature])))
+
+    matrices = {}
+    for feature, vectors in rows.items():
+        mask = np.array([v is not None for v in vectors], dtype=bool)
+        dim = next((v.size for v in vectors if v is not None), 0)
+        matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            if vector is not None:
+                matrix[i] = vector
+        matrices[feature] = (normalize_rows(matrix), mask)
+    return ids, matrices
+
+def weighted_cosine_scores(queries, matrices, weights):
+    # queries maps feature -> query vector; features missing on a video drop out of
+    # both the weighted sum and the weight total, so each video is renormalized on its own
+    return weighted_cosine_score_matrix([queries], matrices, weights)[0]
+
+def weighted_cosine_score_matrix(query_sets, matrices, weights):
+    # One row of scores per query set (e.g. per user), with a single matrix product
+    # per feature instead of one pass over the candidates per query
+    num_videos = len(next(iter(matrices.values()))[1]) if matrices else 0
+    weighted_sum = np.zeros((len(query_sets), num_videos), dtype=np.float32)
+    total_weight = np.zeros((len(query_sets), num_videos), dtype=np.float32)
+
+    for feature, weight in weights.items():
+        matrix, mask = matrices[feature]
+        if matrix.shape[1] == 0:
+            continue
+        vectors = [to_vector(queries.get(feature)) for queries in query_sets]
+        rows = [i for i, vector in enumerate(vectors) if vector is not None]
+        if not rows:
+            continue
+        query_matrix = normalize_rows(np.stack([vectors[i].reshape(-1) for i in rows]))
+        products = matrix.dot(query_matrix) if isinstance(matrix, QuantizedMatrix) else query_matrix @ matrix.T
+        weighted_sum[rows] += weight * products * mask
+        total_weight[rows] += weight * mask
+
+    valid = total_weight > 0
+    scores = np.full((len(query_sets), num_videos), -np.inf, dtype=np.float32)
+    scores[valid] = weighted_sum[valid] / total_weight[valid]
+    return scores
+
+def top_k_rows(scores, k, allowed=None):
+    # Row positions of the k best scores, best first; allowed is an optional boolean
+    # mask of rows that may be returned
+    finite = np.isfinite(scores)
+    if allowed is not None:
+        finite &= allowed
+    valid = np.flatnonzero(finite)
+    if k <= 0 or valid.size == 0:
+        return valid[:0]
+    if valid.size > k:
+        valid = valid[np.argpartition(-scores[valid], k - 1)[:k]]
+    return valid[np.argsort(-scores[valid], kind='stable')]
+
+def top_k(scores, ids, k, allowed=None):
+    # ids may be a numpy string array (memory-mapped snapshots); hand back plain str
+    return [(float(scores[i]), ids[i].item() if isinstance(ids[i], np.generic) else ids[i]) for i in top_k_rows(scores, k, allowed)]
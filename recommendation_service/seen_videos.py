@@ -0,0 +1,37 @@
+from datetime import datetime
+from pymongo import UpdateOne
+
+# Videos already recommended to a user, one small document per (user_id, video_id)
+# in the seen_videos collection instead of an ever-growing users.videos_seen array.
+# The legacy array is still read until migrate_legacy_seen has moved it over.
+
+def seen_collection(users_collection):
+    return users_collection.database['seen_videos']
+
+def get_seen_video_ids(users_collection, user):
+    seen = set(user.get('videos_seen') or [])
+    cursor = seen_collection(users_collection).find({'user_id': user['_id']}, {'_id': 0, 'video_id': 1})
+    seen.update(doc['video_id'] for doc in cursor)
+    return seen
+
+def mark_seen(users_collection, user_id, video_ids):
+    if not video_ids:
+        return
+    now = datetime.now()
+    operations = [
+        UpdateOne({'user_id': user_id, 'video_id': video_id}, {'$setOnInsert': {'seen_at': now}}, upsert=True)
+        for video_id in video_ids
+    ]
+    seen_collection(users_collection).bulk_write(operations, ordered=False)
+
+def migrate_legacy_seen(users_collection):
+    migrated = 0
+    for user in users_collection.find({'videos_seen.0': {'$exists': True}}, {'videos_seen': 1}):
+        mark_seen(users_collection, user['_id'], user['videos_seen'])
+        users_collection.update_one({'_id': user['_id']}, {'$unset': {'videos_seen': ''}})
+        migrated += 1
+    return migrated
+
+if __name__ == '__main__':
+    from providers import get_collection
+    print(f"Moved videos_seen of {migrate_legacy_seen(get_collection('users'))} users into seen_videos")
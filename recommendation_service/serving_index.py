@@ -0,0 +1,371 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from scoring import feature_fields, stack_candidates
+from indexes import candidate_projection, candidate_batch_size, live_videos
+from quantization import QuantizedMatrix, serving_precision
+from metrics import serving_refresh_seconds, serving_refresh_videos, serving_refresh_lag, serving_delta_rows, serving_tombstones
+
+# In-memory candidate index for get_top_3. Videos are kept sorted by
+# duration_in_seconds, so a duration window is a contiguous slice of every
+# feature matrix and needs no database round trip.
+
+# 'mongo' queries the videos collection per request; 'memory' serves from this index
+# built in-process; 'snapshot' attaches read-only to the memory-mapped export from snapshot.py
+candidate_source = os.getenv("CANDIDATE_SOURCE", "mongo")
+
+# A quantized index shortlists this many candidates per ranking for an exact float32 rerank
+rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "200"))
+
+# The memory and snapshot sources pull videos whose updated_at passed the watermark every
+# interval (0 turns refresh off). The overlap re-reads a few seconds behind the watermark
+# so writes that commit out of timestamp order are not missed.
+serving_refresh_interval = float(os.getenv("SERVING_REFRESH_INTERVAL", "10"))
+serving_refresh_overlap = timedelta(seconds=float(os.getenv("SERVING_REFRESH_OVERLAP", "5")))
+compact_delta_rows = int(os.getenv("COMPACT_DELTA_ROWS", "20000"))
+compact_tombstone_fraction = float(os.getenv("COMPACT_TOMBSTONE_FRACTION", "0.1"))
+
+logger = logging.getLogger(__name__)
+
+class CatalogueIndex:
+    def __init__(self, ids, durations, matrices, version=None, exact=None, watermark=None):
+        # matrices may be QuantizedMatrix; exact then optionally holds the float32
+        # matrices used for reranking, otherwise the rerank reads them from Mongo.
+        # watermark is the newest updated_at the index was built from.
+        order = np.argsort(durations, kind='stable')
+        self.ids = np.asarray(ids, dtype=object)[order]
+        self.durations = np.asarray(durations, dtype=np.int32)[order]
+        self.matrices = {feature: (matrix[order], mask[order]) for feature, (matrix, mask) in matrices.items()}
+        self.exact = {feature: (matrix[order], mask[order]) for feature, (matrix, mask) in exact.items()} if exact else None
+        self.version = version
+        self.watermark = watermark
+        self.id_lookup = None
+
+    @classmethod
+    def from_sorted(cls, ids, durations, matrices, version=None, exact=None, watermark=None):
+        # Wraps arrays already in duration order (e.g. memory-mapped) without copying them
+        index = cls.__new__(cls)
+        index.ids = ids
+        index.durations = durations
+        index.matrices = matrices
+        index.exact = exact
+        index.version = version
+        index.watermark = watermark
+        index.id_lookup = None
+        return index
+
+    def segments(self):
+        # (index, alive mask or None) pairs to rank over; a plain index is one segment
+        return [(self, None)]
+
+    def rows_of(self, video_ids):
+        # Rows holding any of the given ids, via a sorted copy of the id column built on first use
+        if self.id_lookup is None:
+            order = np.argsort(self.ids, kind='stable')
+            self.id_lookup = (self.ids[order], order)
+        sorted_ids, order = self.id_lookup
+        if not len(sorted_ids) or not len(video_ids):
+            return np.zeros(0, dtype=np.intp)
+        wanted = np.asarray(video_ids, dtype=sorted_ids.dtype)
+        positions = np.minimum(np.searchsorted(sorted_ids, wanted), len(sorted_ids) - 1)
+        return order[positions[sorted_ids[positions] == wanted]]
+
+    @property
+    def quantized(self):
+        return any(isinstance(matrix, QuantizedMatrix) for matrix, _ in self.matrices.values())
+
+    def quantize(self, precision, keep_exact=False):
+        matrices = {feature: (QuantizedMatrix.quantize(matrix, precision), mask) for feature, (matrix, mask) in self.matrices.items()}
+        return CatalogueIndex.from_sorted(self.ids, self.durations, matrices, self.version, self.matrices if keep_exact else None)
+
+    def nbytes(self):
+        return self.ids.nbytes + self.durations.nbytes + sum(matrix.nbytes + mask.nbytes for matrix, mask in self.matrices.values())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def window(self, target_duration, tolerance):
+        start = np.searchsorted(self.durations, target_duration - tolerance, side='left')
+        stop = np.searchsorted(self.durations, target_duration + tolerance, side='right')
+        return int(start), int(stop)
+
+    def windows(self, target_durations, tolerances):
+        # One slice per (duration, tolerance) pair; a scalar tolerance applies to all
+        tolerances = np.broadcast_to(tolerances, np.shape(target_durations))
+        return [self.window(target, tolerance) for target, tolerance in zip(target_durations, tolerances)]
+
+    def candidates(self, start, stop):
+        # Views into the sorted matrices, not copies
+        ids = self.ids[start:stop]
+        matrices = {feature: (matrix[start:stop], mask[start:stop]) for feature, (matrix, mask) in self.matrices.items()}
+        return ids, matrices
+
+    def exact_candidates(self, rows, video_collection=None):
+        # float32 candidates for the given rows, for reranking a quantized shortlist.
+        # Rows whose video has gone from Mongo come back with every feature masked out.
+        ids = self.ids[rows]
+        if not self.quantized:
+            return ids, {feature: (matrix[rows], mask[rows]) for feature, (matrix, mask) in self.matrices.items()}
+        if self.exact is not None:
+            return ids, {feature: (np.asarray(matrix[rows]), mask[rows]) for feature, (matrix, mask) in self.exact.items()}
+        if video_collection is None:
+            from providers import get_collection
+            video_collection = get_collection('videos')
+        video_ids = [video_id.item() if isinstance(video_id, np.generic) else video_id for video_id in ids]
+        videos = {video['video_id']: video for video in video_collection.find({'video_id': {'$in': video_ids}}, candidate_projection)}
+        _, matrices = stack_candidates([videos.get(video_id, {'video_id': video_id}) for video_id in video_ids])
+        return ids, matrices
+
+    @classmethod
+    def from_videos(cls, videos):
+        ids = []
+        durations = []
+        matrices = concat_matrices([stack_chunk(videos, ids, durations)]) if videos else empty_matrices()
+        return cls(ids, durations, matrices, watermark=max((video.get('updated_at') for video in videos if video.get('updated_at')), default=None))
+
+    @classmethod
+    def from_collection(cls, video_collection, query=None, precision='float32'):
+        # With a quantized precision each chunk is quantized as it is read, so the
+        # full float32 catalogue is never held at once
+        ids = []
+        durations = []
+        chunks = []
+        # Read before the scan: anything written during it is newer and is pulled again by the first refresh
+        watermark = latest_update(video_collection)
+        projection = dict(candidate_projection, duration_in_seconds=1)
+        cursor = video_collection.find(dict(live_videos, **(query or {})), projection).batch_size(candidate_batch_size)
+        chunk = []
+        for video in cursor:
+            chunk.append(video)
+            if len(chunk) == candidate_batch_size:
+                chunks.append(stack_chunk(chunk, ids, durations, precision))
+                chunk = []
+        if chunk:
+            chunks.append(stack_chunk(chunk, ids, durations, precision))
+        return cls(ids, durations, concat_matrices(chunks, precision), watermark=watermark)
+
+def latest_update(video_collection):
+    latest = video_collection.find_one({'updated_at': {'$exists': True}}, {'updated_at': 1}, sort=[('updated_at', -1)])
+    return latest['updated_at'] if latest else None
+
+def empty_matrices():
+    return {feature: (np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=bool)) for feature in feature_fields}
+
+def concat_indexes(parts, precision='float32'):
+    # A new duration-sorted index from (index, rows) parts; float32 parts are quantized
+    # when the result is not float32
+    ids = np.concatenate([np.asarray(index.ids[rows], dtype=object) for index, rows in parts])
+    durations = np.concatenate([index.durations[rows] for index, rows in parts])
+    matrices = {}
+    for feature in feature_fields:
+        pieces = []
+        for index, rows in parts:
+            matrix, mask = index.matrices[feature]
+            matrix = matrix[rows]
+            if precision != 'float32' and not isinstance(matrix, QuantizedMatrix):
+                matrix = QuantizedMatrix.quantize(matrix, precision)
+            pieces.append({feature: (matrix, np.asarray(mask[rows]))})
+        matrices[feature] = concat_matrices(pieces, precision, [feature])[feature]
+    return CatalogueIndex(ids, durations, matrices)
+
+def stack_chunk(chunk, ids, durations, precision='float32'):
+    chunk_ids, matrices = stack_candidates(chunk)
+    ids.extend(chunk_ids)
+    durations.extend(video.get('duration_in_seconds', 0) for video in chunk)
+    if precision != 'float32':
+        matrices = {feature: (QuantizedMatrix.quantize(matrix, precision), mask) for feature, (matrix, mask) in matrices.items()}
+    return matrices
+
+def concat_matrices(chunks, precision='float32', features=feature_fields):
+    matrices = {}
+    for feature in features:
+        parts = [chunk[feature] for chunk in chunks]
+        dim = max((matrix.shape[1] for matrix, _ in parts), default=0)
+        padded = [pad_columns(m, dim, precision) for m, _ in parts]
+        if precision != 'float32':
+            matrix = QuantizedMatrix.concatenate(padded) if parts else QuantizedMatrix.zeros(0, 0, precision)
+        else:
+            matrix = np.concatenate(padded) if parts else np.zeros((0, 0), dtype=np.float32)
+        mask = np.concatenate([mask for _, mask in parts]) if parts else np.zeros(0, dtype=bool)
+        matrices[feature] = (matrix, mask)
+    return matrices
+
+def pad_columns(matrix, dim, precision='float32'):
+    # A chunk where every video lacks a feature stacks as (n, 0)
+    if matrix.shape[1] == dim:
+        return matrix
+    if precision != 'float32':
+        return QuantizedMatrix.zeros(matrix.shape[0], dim, precision)
+    return np.zeros((matrix.shape[0], dim), dtype=np.float32)
+
+class CatalogueState:
+    # One consistent view of the catalogue: the large base index with a tombstone mask,
+    # plus a small float32 delta of videos added or changed since the base was built.
+    # States are never modified; a refresh builds a new one and swaps it in, so a
+    # request that took a state keeps a coherent view however long it runs.
+    def __init__(self, base, base_alive, delta, watermark):
+        self.base = base
+        self.base_alive = base_alive
+        self.delta = delta
+        self.watermark = watermark
+        self.tombstones = int(len(base_alive) - np.count_nonzero(base_alive))
+
+    def segments(self):
+        segments = [(self.base, self.base_alive if self.tombstones else None)]
+        if self.delta is not None and len(self.delta):
+            segments.append((self.delta, None))
+        return segments
+
+    def apply(self, videos):
+        # Every pulled video replaces whatever row it had; deleted ones only leave a tombstone
+        latest = {}
+        for video in videos:
+            if video['video_id'] not in latest or video['updated_at'] >= latest[video['video_id']]['updated_at']:
+                latest[video['video_id']] = video
+        changed = list(latest)
+
+        base_alive = self.base_alive.copy()
+        base_alive[self.base.rows_of(changed)] = False
+        parts = []
+        if self.delta is not None and len(self.delta):
+            parts.append((self.delta, np.flatnonzero(~np.isin(self.delta.ids, changed))))
+        added = CatalogueIndex.from_videos([video for video in latest.values() if not video.get('deleted')])
+        if len(added):
+            parts.append((added, np.arange(len(added))))
+        delta = concat_indexes(parts) if parts else None
+        watermark = max(filter(None, [self.watermark, max(video['updated_at'] for video in videos)]))
+        return CatalogueState(self.base, base_alive, delta, watermark)
+
+class LiveCatalogue:
+    # Serving index kept current without reloading: a background thread pulls videos
+    # whose updated_at passed the watermark and applies them as delta rows and
+    # tombstones. Once the delta or the tombstones grow past their thresholds, the base
+    # and delta are merged into a new base off the request path. With follow_snapshots
+    # the base is the exported snapshot and a newer export replaces it instead.
+    def __init__(self, video_collection, base, follow_snapshots=False, refresh_interval=serving_refresh_interval):
+        self.video_collection = video_collection
+        self.state = CatalogueState(base, np.ones(len(base), dtype=bool), None, base.watermark)
+        self.follow_snapshots = follow_snapshots
+        self.refresh_interval = refresh_interval
+        self.refresh_lock = threading.Lock()
+        self.compacting = False
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'refreshes': 0, 'videos_applied': 0, 'compactions': 0, 'last_refresh_seconds': 0.0}
+
+    def start(self):
+        if self.refresh_interval > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='serving-index-refresh', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.exception("Error refreshing serving index: %s", e)
+
+    def segments(self):
+        return self.state.segments()
+
+    @property
+    def version(self):
+        return self.state.base.version
+
+    def refresh(self):
+        with self.refresh_lock:
+            start = time.perf_counter()
+            if self.follow_snapshots:
+                self.follow_snapshot()
+            state = self.state
+            query = {'updated_at': {'$gt': state.watermark - serving_refresh_overlap}} if state.watermark else {'updated_at': {'$exists': True}}
+            projection = dict(candidate_projection, duration_in_seconds=1, updated_at=1, deleted=1)
+            videos = list(self.video_collection.find(query, projection).batch_size(candidate_batch_size))
+            if videos:
+                new_videos = [video['updated_at'] for video in videos if state.watermark is None or video['updated_at'] > state.watermark]
+                self.state = state.apply(videos)
+                if new_videos:
+                    serving_refresh_lag.observe((datetime.now() - min(new_videos)).total_seconds())
+
+            seconds = time.perf_counter() - start
+            serving_refresh_seconds.observe(seconds)
+            serving_refresh_videos.observe(len(videos))
+            serving_delta_rows.set(len(self.state.delta) if self.state.delta is not None else 0)
+            serving_tombstones.set(self.state.tombstones)
+            self.stats['refreshes'] += 1
+            self.stats['videos_applied'] += len(videos)
+            self.stats['last_refresh_seconds'] = seconds
+        if self.needs_compaction():
+            self.compact_async()
+        return len(videos)
+
+    def follow_snapshot(self):
+        from snapshot import current_version, load_snapshot
+        version = current_version()
+        if version is not None and version != self.state.base.version:
+            base = load_snapshot(version=version)
+            self.state = CatalogueState(base, np.ones(len(base), dtype=bool), None, base.watermark)
+
+    def needs_compaction(self):
+        if self.follow_snapshots or self.compacting:
+            return False
+        state = self.state
+        delta_rows = len(state.delta) if state.delta is not None else 0
+        return delta_rows > compact_delta_rows or state.tombstones > compact_tombstone_fraction * max(len(state.base), 1)
+
+    def compact_async(self):
+        self.compacting = True
+        threading.Thread(target=self.compact, name='serving-index-compaction', daemon=True).start()
+
+    def compact(self):
+        try:
+            state = self.state
+            start = time.perf_counter()
+            precision = next((matrix.precision for matrix, _ in state.base.matrices.values() if isinstance(matrix, QuantizedMatrix)), 'float32')
+            parts = [(state.base, np.flatnonzero(state.base_alive))]
+            if state.delta is not None and len(state.delta):
+                parts.append((state.delta, np.arange(len(state.delta))))
+            base = concat_indexes(parts, precision)
+            base.version = state.base.version
+            with self.refresh_lock:
+                # Anything applied after state was taken is newer than its watermark and
+                # gets pulled again by the next refresh
+                self.state = CatalogueState(base, np.ones(len(base), dtype=bool), None, state.watermark)
+            self.stats['compactions'] += 1
+            logger.info("Compacted serving index to %d videos in %.2fs", len(base), time.perf_counter() - start)
+        except Exception as e:
+            logger.exception("Error compacting serving index: %s", e)
+        finally:
+            self.compacting = False
+
+loaded_index = None
+loaded_index_lock = threading.Lock()
+
+def get_serving_index(video_collection=None):
+    global loaded_index
+    if candidate_source == 'snapshot' and serving_refresh_interval <= 0:
+        from snapshot import get_snapshot_index
+        return get_snapshot_index()
+    if loaded_index is None:
+        with loaded_index_lock:
+            if loaded_index is None:
+                if video_collection is None:
+                    from providers import get_collection
+                    video_collection = get_collection('videos')
+                if candidate_source == 'snapshot':
+                    from snapshot import load_snapshot
+                    loaded_index = LiveCatalogue(video_collection, load_snapshot(), follow_snapshots=True).start()
+                else:
+                    base = CatalogueIndex.from_collection(video_collection, precision=serving_precision)
+                    loaded_index = LiveCatalogue(video_collection, base).start()
+    return loaded_index
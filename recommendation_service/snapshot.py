@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from serving_index import CatalogueIndex
+from quantization import QuantizedMatrix, serving_precision
+
+# Versioned, memory-mapped export of the serving index for multi-worker serving.
+# Each snapshot is a directory of .npy files; CURRENT names the live one and is
+# replaced atomically. Workers (CANDIDATE_SOURCE=snapshot) map the files read-only,
+# so the catalogue sits once in the page cache however many workers run, and they
+# pick up a new CURRENT on their next request after the check interval.
+# Exported with a quantized precision, workers scan the int8/float16 codes and only
+# touch the float32 files for the rows they rerank.
+#
+# Export:  python snapshot.py export
+# Serve:   CANDIDATE_SOURCE=snapshot gunicorn -c gunicorn.conf.py app:app
+
+snapshot_dir = os.getenv("SNAPSHOT_DIR", "snapshots")
+snapshot_check_interval = float(os.getenv("SNAPSHOT_CHECK_INTERVAL", "5"))
+snapshots_to_keep = int(os.getenv("SNAPSHOTS_TO_KEEP", "3"))
+
+def export_snapshot(index, root=None, precision=None):
+    root = root or snapshot_dir
+    precision = precision or serving_precision
+    os.makedirs(root, exist_ok=True)
+    version = time.strftime('v%Y%m%d%H%M%S') + f'{time.time_ns() % 1000000000:09d}'
+    tmp_dir = os.path.join(root, version + '.tmp')
+    os.makedirs(tmp_dir)
+
+    # Fixed-width unicode ids so the id table can be memory-mapped too
+    np.save(os.path.join(tmp_dir, 'ids.npy'), np.asarray(index.ids, dtype=str))
+    np.save(os.path.join(tmp_dir, 'durations.npy'), np.asarray(index.durations, dtype=np.int32))
+    for feature, (matrix, mask) in index.matrices.items():
+        np.save(os.path.join(tmp_dir, f'{feature}.npy'), np.ascontiguousarray(matrix, dtype=np.float32))
+        np.save(os.path.join(tmp_dir, f'{feature}_mask.npy'), np.asarray(mask, dtype=bool))
+        if precision != 'float32':
+            quantized = QuantizedMatrix.quantize(matrix, precision)
+            np.save(os.path.join(tmp_dir, f'{feature}_codes.npy'), quantized.codes)
+            np.save(os.path.join(tmp_dir, f'{feature}_scales.npy'), quantized.scales)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'version': version, 'videos': len(index.ids), 'features': list(index.matrices), 'precision': precision,
+                   'watermark': index.watermark.isoformat() if index.watermark else None}, f)
+
+    os.rename(tmp_dir, os.path.join(root, version))
+    pointer = os.path.join(root, 'CURRENT')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(version)
+    os.replace(pointer + '.tmp', pointer)
+    prune_snapshots(root, version)
+    return version
+
+def prune_snapshots(root, current):
+    # Workers still mapping a removed snapshot keep reading it until they swap
+    versions = sorted(name for name in os.listdir(root) if name.startswith('v') and not name.endswith('.tmp'))
+    for name in versions[:-snapshots_to_keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def current_version(root=None):
+    root = root or snapshot_dir
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def load_snapshot(root=None, version=None):
+    root = root or snapshot_dir
+    version = version or current_version(root)
+    if version is None:
+        raise FileNotFoundError(f'No snapshot exported under {root}')
+    path = os.path.join(root, version)
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    load = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+    watermark = datetime.fromisoformat(meta['watermark']) if meta.get('watermark') else None
+    matrices = {feature: (load(feature), load(feature + '_mask')) for feature in meta['features']}
+    if meta.get('precision', 'float32') != 'float32':
+        quantized = {feature: (QuantizedMatrix(load(feature + '_codes'), load(feature + '_scales')), mask) for feature, (_, mask) in matrices.items()}
+        return CatalogueIndex.from_sorted(load('ids'), load('durations'), quantized, version, exact=matrices, watermark=watermark)
+    return CatalogueIndex.from_sorted(load('ids'), load('durations'), matrices, version, watermark=watermark)
+
+snapshot_index = None
+snapshot_checked_at = 0.0
+snapshot_lock = threading.Lock()
+
+def get_snapshot_index():
+    # Swaps to a newer snapshot without blocking requests already using the old one
+    global snapshot_index, snapshot_checked_at
+    now = time.monotonic()
+    if snapshot_index is not None and now - snapshot_checked_at < snapshot_check_interval:
+        return snapshot_index
+    with snapshot_lock:
+        if snapshot_index is None or now - snapshot_checked_at >= snapshot_check_interval:
+            version = current_version()
+            if snapshot_index is None or version != snapshot_index.version:
+                snapshot_index = load_snapshot(version=version)
+            snapshot_checked_at = now
+    return snapshot_index
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the serving index as a memory-mapped snapshot')
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('--dir', default=snapshot_dir)
+    parser.add_argument('--precision', default=serving_precision, choices=['float32', 'float16', 'int8'])
+    args = parser.parse_args()
+
+    from providers import get_collection
+    index = CatalogueIndex.from_collection(get_collection('videos'))
+    version = export_snapshot(index, args.dir, args.precision)
+    print(f"Exported {len(index.ids)} videos as snapshot {version}")
+
+if __name__ == '__main__':
+    main()